@@ -2,9 +2,30 @@
 import re
 import logging
 import os
-from typing import List, Dict, Any, Optional, Pattern
+import time
+import select
+import shelve
+import pickle
+import dbm
+import atexit
+import threading
+import queue
+import functools
+import hashlib
+import json
+import tempfile
+from collections import OrderedDict
+import concurrent.futures
+import asyncio
+from typing import List, Dict, Any, Optional, Pattern, NamedTuple, Tuple, Iterator, Iterable, FrozenSet, Callable, Set
 
 from netmiko import ConnectHandler, NetmikoAuthenticationException, NetmikoTimeoutException
+from netmiko.exceptions import NetmikoBaseException, SSHException
+
+try:  # Opcjonalny transport asynchroniczny (cli_transport = asyncssh)
+    import asyncssh
+except ImportError:
+    asyncssh = None
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +33,51 @@ logger = logging.getLogger(__name__)
 EMERGENCY_DEFAULT_EXPECT_PATTERN = r"[a-zA-Z0-9\S\.\-]*[#>]"  # Bardzo ogólny prompt
 EMERGENCY_NETMIKO_LOG_TEMPLATE = "{host}_netmiko_diagnostic_emergency.log"
 
+# --- Znaczniki początku bloków (dopasowywane in-place przez match(text, pos, endpos), bez kopiowania) ---
+_LLDP_BLOCK_START_RE = re.compile(r'\s*chassis id:', re.IGNORECASE)
+_LLDP_CHASSIS_RE = re.compile(r'chassis id:', re.IGNORECASE)
+_CDP_NOT_ENABLED_TEXT_RE = re.compile(r'cdp not enabled', re.IGNORECASE)
+_CDP_DEVICE_ID_MARKER_RE = re.compile(r"Device ID\s*:", re.IGNORECASE)
+_HOST_SANITIZE_RE = re.compile(r'[^\w\.-]')
+_NON_SPACE_RE = re.compile(r'\S')
+_NOT_ADVERTISED = "not advertised"
+
+# --- Typowe komunikaty błędów zamiast tabeli sąsiadów (sprawdzane tylko na początku wyjścia) ---
+_CLI_ERROR_HEAD_LEN = 256
+_PAGER_HEAD_LEN = 4096  # Pager pojawia się po pierwszej stronie wyjścia
+_PAGER_RE = re.compile(r"-{2,}\s*more\s*-{2,}|<--- more --->", re.IGNORECASE)
+_CDP_ERROR_RE = re.compile(
+    r"^\s*%?\s*(?:cdp (?:is )?not enabled|invalid input|unknown command|no cdp|incomplete command|"
+    r">>\s*cdp run not configured)", re.IGNORECASE | re.MULTILINE)
+_CDP_DISABLED_HEAD_LEN = 512
+_CDP_DISABLED_RE = re.compile(r"cdp.{0,12}not.{0,12}enabled", re.IGNORECASE)
+_LLDP_ERROR_RE = re.compile(
+    r"^\s*%?\s*(?:lldp (?:is )?not enabled|invalid input|unknown command|incomplete command)",
+    re.IGNORECASE | re.MULTILINE)
+# Słowa w treści wyjątku Netmiko oznaczające odrzuconą komendę (uruchamia komendę zapasową LLDP)
+_CMD_REJECTED_RE = re.compile(r"invalid|incomplete|unrecognized", re.IGNORECASE)
+
+# --- Protokoły sąsiedztwa obsługiwane przez platformy (typ Netmiko -> protokoły) ---
+# Typy spoza mapy traktowane są jak obsługujące oba protokoły. Junos sterowany jest przez cli_junos_try_cdp.
+_PROTO_ALL: FrozenSet[str] = frozenset({"lldp", "cdp"})
+_PROTO_SUPPORT: Dict[str, FrozenSet[str]] = {
+    "arista_eos": frozenset({"lldp"}),
+    "linux": frozenset({"lldp"}),
+    "hp_procurve": frozenset({"lldp"}),
+    "hp_comware": frozenset({"lldp"}),
+    "huawei": frozenset({"lldp"}),
+    "dell_os10": frozenset({"lldp"}),
+    "cisco_ios": _PROTO_ALL,
+    "cisco_xe": _PROTO_ALL,
+    "cisco_nxos": _PROTO_ALL,
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_compile(pattern_str: str, flags: int) -> Pattern[str]:
+    """re.compile z cache na poziomie modułu - każda para (wzorzec, flagi) kompilowana jest raz na cały przebieg."""
+    return re.compile(pattern_str, flags)
+
 
 def _compile_regex(pattern_str: Optional[str], flags: int = 0, context: str = "unknown regex") -> Optional[
     Pattern[str]]:
@@ -21,142 +87,345 @@ def _compile_regex(pattern_str: Optional[str], flags: int = 0, context: str = "u
     """
     if not pattern_str or not pattern_str.strip():
         logger.error(
-            f"Błąd kompilacji regex ({context}): Otrzymano pusty lub None pattern_str ('{pattern_str}'). To powinno być obsłużone przez config_loader. Zwracam None.")
+            "Błąd kompilacji regex (%s): Otrzymano pusty lub None pattern_str ('%s'). To powinno być obsłużone przez config_loader. Zwracam None.", context, pattern_str)
         return None
     try:
-        compiled_regex = re.compile(pattern_str, flags)
-        logger.debug(f"Pomyślnie skompilowano regex ({context}): '{pattern_str}' z flagami {flags}")
+        compiled_regex = _cached_compile(pattern_str, flags)
+        logger.debug("Pomyślnie skompilowano regex (%s): '%s' z flagami %s", context, pattern_str, flags)
         return compiled_regex
     except re.error as e:
         logger.error(
-            f"Błąd kompilacji regex ({context}) dla wzorca '{pattern_str}' z flagami {flags}: {e}. Zwracam None.")
+            "Błąd kompilacji regex (%s) dla wzorca '%s' z flagami %s: %s. Zwracam None.", context, pattern_str, flags, e)
         return None
     except Exception as e_generic_compile:  # Złap inne nieoczekiwane błędy podczas kompilacji
         logger.error(
-            f"Nieoczekiwany błąd podczas kompilacji regex ({context}) dla wzorca '{pattern_str}': {e_generic_compile}. Zwracam None.",
+            "Nieoczekiwany błąd podczas kompilacji regex (%s) dla wzorca '%s': %s. Zwracam None.", context, pattern_str, e_generic_compile,
             exc_info=True)
         return None
 
 
-def _normalize_interface_name(if_name: str, replacements: Dict[str, str]) -> str:
-    if_name = if_name.strip()
-    # Sortuj wg długości klucza malejąco, aby np. "TenGigabitEthernet" było sprawdzane przed "GigabitEthernet"
-    for long, short in sorted(replacements.items(), key=lambda item: len(item[0]), reverse=True):
-        if if_name.lower().startswith(long.lower()):  # Porównuj case-insensitive
-            return short + if_name[len(long):]
-    return if_name
+@functools.lru_cache(maxsize=256)
+def _is_valid_expect_pattern(pattern_str: str) -> bool:
+    """
+    Sprawdza raz dla danego wzorca, czy expect_string jest poprawnym regexem.
+    Kompilacja zasila też wewnętrzny cache modułu re, z którego korzysta Netmiko przy kolejnych komendach.
+    """
+    return _compile_regex(pattern_str, context="expect_string") is not None
+
+
+def _strip_span(text: str, start: int, end: int) -> Optional[Tuple[int, int]]:
+    """Odpowiednik text[start:end].strip() na indeksach - zwraca (start, end) bez białych znaków lub None dla pustego."""
+    first = _NON_SPACE_RE.search(text, start, end)
+    if not first:
+        return None
+    start = first.start()
+    while text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _iter_block_spans(text: str, splitter: Pattern[str], pos: int = 0) -> Iterator[Tuple[int, int]]:
+    """
+    Jedno przejście finditer zamiast re.split: zwraca (start, end) niepustych bloków między dopasowaniami
+    splitter (jak [b.strip() for b in splitter.split(text[pos:]) if b.strip()]), bez tworzenia kopii bloków.
+    Pola bloku wyszukuje się potem przez regex.search(text, start, end).
+    """
+    for match in splitter.finditer(text, pos):
+        span = _strip_span(text, pos, match.start())
+        if span:
+            yield span
+        pos = match.end()
+    span = _strip_span(text, pos, len(text))
+    if span:
+        yield span
+
+
+@functools.lru_cache(maxsize=16)
+def _cached_normalizer(replacements: FrozenSet[Tuple[str, str]]) -> Callable[[str], str]:
+    # Prefiksy od najdłuższego, aby np. "TenGigabitEthernet" było sprawdzane przed "GigabitEthernet"
+    prepared = sorted(((long.lower(), short) for long, short in replacements if long),
+                      key=lambda item: (-len(item[0]), item[0]))
+    if not prepared:
+        return str.strip
+    short_by_prefix: Dict[str, str] = {}
+    for lower_prefix, short in prepared:
+        short_by_prefix.setdefault(lower_prefix, short)
+    # Jedna zakotwiczona alternatywa (case-insensitive) zamiast pętli startswith po prefiksach
+    prefix_re = re.compile("|".join(re.escape(lower_prefix) for lower_prefix in short_by_prefix), re.IGNORECASE)
+
+    def normalize(if_name: str) -> str:
+        if_name = if_name.strip()
+        match = prefix_re.match(if_name)
+        if match:
+            return short_by_prefix[match.group().lower()] + if_name[match.end():]
+        return if_name
+
+    return normalize
+
+
+def _build_normalizer(replacements: Dict[str, str]) -> Callable[[str], str]:
+    """Zwraca funkcję skracającą nazwy interfejsów; przygotowana lista prefiksów jest cache'owana per zestaw zamian."""
+    return _cached_normalizer(frozenset(replacements.items()))
+
+
+class CliPlan(NamedTuple):
+    platform_for_log: str
+    lldp_cmd: str
+    cdp_cmd: str
+    lldp_exp: Optional[str]
+    cdp_exp: Optional[str]
+    run_cdp: bool
+    pre_cmds: Tuple[Tuple[str, Optional[int]], ...]  # (komenda, read_timeout lub None)
+    lldp_fallback_cmd: Optional[str] = None  # Druga próba, gdy lldp_cmd zostanie odrzucona przez urządzenie
+
+
+class PlatformMarkers(NamedTuple):
+    """Znaczniki platformy wyciągnięte z 'show version' - jedyne, co z tego wyjścia wpływa na plan komend."""
+    extreme: bool  # 'exos' lub 'enterasys'
+    juniper: bool
+    catalyst: bool
+    nxos: bool
+
+
+def _platform_markers(system_info_str: str) -> PlatformMarkers:
+    """Zamienia (małymi literami) wyjście 'show version' na znaczniki platformy dla _plan_cli_commands."""
+    return PlatformMarkers("exos" in system_info_str or "enterasys" in system_info_str,
+                           "juniper" in system_info_str, "catalyst" in system_info_str, "nx-os" in system_info_str)
+
+
+@functools.lru_cache(maxsize=128)
+def _plan_cli_commands(effective_device_type: str, markers: PlatformMarkers, common_expect_str: Optional[str],
+                       junos_try_cdp: bool) -> CliPlan:
+    """
+    Ustala komendy LLDP/CDP, expect_string i komendy wstępne (np. wyłączenie stronicowania) dla platformy.
+    Klucz cache to typ urządzenia i znaczniki platformy (nie pełne 'show version', różne na każdym hoście),
+    więc plan jest współdzielony między hostami tego samego typu.
+    """
+    device_type_lower = effective_device_type.lower()
+    if "extreme" in device_type_lower or markers.extreme:
+        return CliPlan("Extreme", "show lldp neighbors detailed", "show cdp neighbor detail",
+                       common_expect_str, common_expect_str, True, (("disable clipaging", None),))
+    if "junos" in device_type_lower or markers.juniper:
+        return CliPlan("Junos", "show lldp neighbors interface all detail", "show cdp neighbors detail",
+                       common_expect_str, common_expect_str if junos_try_cdp else None, junos_try_cdp,
+                       (("set cli screen-length 0", 15),))
+    if markers.nxos or "cisco_nxos" in device_type_lower:
+        # NX-OS: bez 'terminal length 0'; komenda zapasowa LLDP tylko tutaj, nie dla IOS/XE
+        return CliPlan("Cisco NX-OS", "show lldp neighbors detail", "show cdp neighbors detail",
+                       common_expect_str, common_expect_str, True, (), "show lldp neighbors")
+    if "ios" in device_type_lower or markers.catalyst or "cisco_xe" in device_type_lower:
+        return CliPlan("Cisco-like (IOS/XE)", "show lldp neighbors detail", "show cdp neighbors detail",
+                       common_expect_str, common_expect_str, True, (("terminal length 0", 15),))
+    return CliPlan("Unknown/Default", "show lldp neighbors detail", "show cdp neighbors detail",
+                   common_expect_str, common_expect_str, True, ())
+
+
+def _supported_protocols(effective_device_type: str, force_protocol: Optional[str]) -> FrozenSet[str]:
+    """
+    Zwraca protokoły (lldp/cdp), które warto odpytywać na danej platformie.
+    force_protocol ('lldp', 'cdp', 'both') z konfiguracji nadpisuje mapę _PROTO_SUPPORT.
+    """
+    force = (force_protocol or "").strip().lower()
+    if force == "both":
+        return _PROTO_ALL
+    if force in _PROTO_ALL:
+        return frozenset({force})
+    if force:
+        logger.warning("  CLI: Nieznana wartość cli_force_protocol '%s'. Używam mapy platform.", force_protocol)
+    return _PROTO_SUPPORT.get(effective_device_type, _PROTO_ALL)
+
+
+def _lldp_cdp_read_timeout(host: str, config: Dict[str, Any]) -> float:
+    """read_timeout dla komend LLDP/CDP: wpis hosta z cli_read_timeout_overrides lub cli_read_timeout_lldp_cdp."""
+    default_timeout = config.get('cli_read_timeout_lldp_cdp', 20)
+    override = (config.get('cli_read_timeout_overrides') or {}).get(host)
+    if override is None:
+        return default_timeout
+    try:
+        return float(override)
+    except (TypeError, ValueError):
+        logger.warning("  CLI: Niepoprawny read_timeout '%s' dla %s w cli_read_timeout_overrides. Używam %ss.",
+                       override, host, default_timeout)
+        return default_timeout
+
+
+class LldpRegexBundle(NamedTuple):
+    block_split_pattern: Optional[str]
+    block_split: Optional[Pattern[str]]
+    local_port_id: Optional[Pattern[str]]
+    sys_name: Optional[Pattern[str]]
+    remote_port_id: Optional[Pattern[str]]
+    remote_port_desc: Optional[Pattern[str]]
+    vlan_id: Optional[Pattern[str]]
+
+
+class CdpRegexBundle(NamedTuple):
+    block_split_pattern: Optional[str]
+    block_split: Optional[Pattern[str]]
+    device_id: Optional[Pattern[str]]
+    local_if: Optional[Pattern[str]]
+    remote_if: Optional[Pattern[str]]
+
+
+_LLDP_REGEX_KEYS = ('lldp_regex_block_split', 'lldp_regex_local_port_id', 'lldp_regex_sys_name',
+                    'lldp_regex_remote_port_id', 'lldp_regex_remote_port_desc', 'lldp_regex_vlan_id')
+_CDP_REGEX_KEYS = ('cdp_regex_block_split', 'cdp_regex_device_id', 'cdp_regex_local_if', 'cdp_regex_remote_if')
+
+
+@functools.lru_cache(maxsize=16)
+def _build_lldp_bundle(patterns: Tuple[Optional[str], ...]) -> LldpRegexBundle:
+    block_split, local_port_id, sys_name, remote_port_id, remote_port_desc, vlan_id = patterns
+    field_flags = re.MULTILINE | re.IGNORECASE
+    return LldpRegexBundle(
+        block_split,
+        _compile_regex(block_split, re.IGNORECASE, context="lldp_block_split"),
+        _compile_regex(local_port_id, field_flags, context="lldp_local_port_id"),
+        _compile_regex(sys_name, field_flags, context="lldp_sys_name"),
+        _compile_regex(remote_port_id, field_flags, context="lldp_remote_port_id"),
+        _compile_regex(remote_port_desc, field_flags, context="lldp_remote_port_desc"),
+        _compile_regex(vlan_id, field_flags, context="lldp_vlan_id"))
+
+
+@functools.lru_cache(maxsize=16)
+def _build_cdp_bundle(patterns: Tuple[Optional[str], ...]) -> CdpRegexBundle:
+    block_split, device_id, local_if, remote_if = patterns
+    return CdpRegexBundle(
+        block_split,
+        _compile_regex(block_split, re.MULTILINE, context="cdp_block_split"),
+        _compile_regex(device_id, re.IGNORECASE, context="cdp_device_id"),
+        _compile_regex(local_if, re.IGNORECASE, context="cdp_local_if"),
+        _compile_regex(remote_if, re.IGNORECASE, context="cdp_remote_if"))
+
+
+def _lldp_regex_bundle(config: Dict[str, Any]) -> LldpRegexBundle:
+    """Skompilowane regexy LLDP z config - budowane raz dla danego zestawu wzorców i współdzielone między hostami."""
+    return _build_lldp_bundle(tuple(config.get(key) for key in _LLDP_REGEX_KEYS))
+
+
+def _cdp_regex_bundle(config: Dict[str, Any]) -> CdpRegexBundle:
+    """Skompilowane regexy CDP z config - budowane raz dla danego zestawu wzorców i współdzielone między hostami."""
+    return _build_cdp_bundle(tuple(config.get(key) for key in _CDP_REGEX_KEYS))
+
+
+def _has_na(value: str, _marker: str = _NOT_ADVERTISED) -> bool:
+    """Czy wartość pola LLDP to 'not advertised' (bez względu na wielkość liter)."""
+    return _marker in value.casefold()
+
+
+def _choose_lldp_remote_port(port_id: str, port_desc: str) -> str:
+    """
+    Wybiera nazwę portu sąsiada z LLDP: Port ID, chyba że jest pusty/nieogłaszany/wygląda na MAC
+    albo Port Description jest krótszą, sensowną nazwą interfejsu.
+    """
+    if not port_desc or _has_na(port_desc):
+        return port_id
+    # Najtańsze testy najpierw: casefold() i isalnum() tylko, gdy prostsze warunki nie rozstrzygnęły
+    if (not port_id or
+            ':' in port_id or
+            _has_na(port_id) or
+            (len(port_id) > 20 and not port_id.isalnum())
+    ):
+        return port_desc
+    if len(port_desc) < len(port_id) and ':' not in port_desc:
+        return port_desc
+    return port_id
 
 
 def _parse_lldp_output(lldp_output: str, local_hostname: str, config: Dict[str, Any]) -> List[Dict[str, Any]]:
     connections: List[Dict[str, Any]] = []
     if not lldp_output:
-        logger.debug(f"CLI-LLDP: Brak danych LLDP do sparsowania dla {local_hostname}.")
+        logger.debug("CLI-LLDP: Brak danych LLDP do sparsowania dla %s.", local_hostname)
         return connections
-    logger.debug(f"CLI-LLDP: Próba parsowania danych LLDP dla {local_hostname} (długość: {len(lldp_output)})...")
+    logger.debug("CLI-LLDP: Próba parsowania danych LLDP dla %s (długość: %s)...", local_hostname, len(lldp_output))
 
-    lldp_regex_block_split_pattern = config.get('lldp_regex_block_split')
-    re_lldp_block_split = _compile_regex(lldp_regex_block_split_pattern, re.IGNORECASE, context="lldp_block_split")
+    parse_start = 0  # Offset początku danych w lldp_output - bloki i pola wyszukiwane są na indeksach, bez kopii
+    # Bez 'Chassis id:' nie ma czego parsować - sprawdź przed pobraniem regexów i normalizatora
+    if not _LLDP_BLOCK_START_RE.match(lldp_output):
+        first_chassis_match = _LLDP_CHASSIS_RE.search(lldp_output)
+        if first_chassis_match:
+            parse_start = first_chassis_match.start()
+        else:
+            logger.info(
+                "CLI-LLDP: Dane LLDP dla %s nie zaczynają się od 'Chassis id:' i nie znaleziono znacznika.", local_hostname)
+            logger.warning(
+                "CLI-LLDP: Słowo kluczowe 'Chassis id:' nie znalezione w danych LLDP dla %s. Parsowanie prawdopodobnie się nie powiedzie.", local_hostname)
+            return connections
+
+    bundle = _lldp_regex_bundle(config)
+    lldp_regex_block_split_pattern = bundle.block_split_pattern
+    re_lldp_block_split = bundle.block_split
     if not re_lldp_block_split:
         logger.error(
-            f"CLI-LLDP: Krytyczny regex 'lldp_regex_block_split' (wzorzec: '{lldp_regex_block_split_pattern}') nie skompilował się. Przerywam parsowanie LLDP dla {local_hostname}.")
+            "CLI-LLDP: Krytyczny regex 'lldp_regex_block_split' (wzorzec: '%s') nie skompilował się. Przerywam parsowanie LLDP dla %s.", lldp_regex_block_split_pattern, local_hostname)
         return connections
 
-    # Kompiluj pozostałe regexy; jeśli się nie skompilują, parsowanie konkretnych pól może zawieść
-    re_lldp_local_port_id = _compile_regex(config.get('lldp_regex_local_port_id'), re.MULTILINE | re.IGNORECASE,
-                                           context="lldp_local_port_id")
-    re_lldp_sys_name = _compile_regex(config.get('lldp_regex_sys_name'), re.MULTILINE | re.IGNORECASE,
-                                      context="lldp_sys_name")
-    re_lldp_remote_port_id = _compile_regex(config.get('lldp_regex_remote_port_id'), re.MULTILINE | re.IGNORECASE,
-                                            context="lldp_remote_port_id")
-    re_lldp_remote_port_desc = _compile_regex(config.get('lldp_regex_remote_port_desc'), re.MULTILINE | re.IGNORECASE,
-                                              context="lldp_remote_port_desc")
-    re_lldp_vlan_id = _compile_regex(config.get('lldp_regex_vlan_id'), re.MULTILINE | re.IGNORECASE,
-                                     context="lldp_vlan_id")
-
-    interface_replacements = config.get('interface_name_replacements', {})
-    data_to_parse = lldp_output
-
-    if not data_to_parse.strip().lower().startswith('chassis id:'):
-        first_chassis_match = re.search(r'Chassis id:', data_to_parse, re.IGNORECASE)
-        if first_chassis_match:
-            data_to_parse = data_to_parse[first_chassis_match.start():]
-        else:
-            logger.info(
-                f"CLI-LLDP: Dane LLDP dla {local_hostname} nie zaczynają się od 'Chassis id:' i nie znaleziono znacznika.")
-            if 'chassis id:' not in data_to_parse.lower():  # Jeśli w ogóle nie ma "Chassis id:"
-                logger.warning(
-                    f"CLI-LLDP: Słowo kluczowe 'Chassis id:' nie znalezione w danych LLDP dla {local_hostname}. Parsowanie prawdopodobnie się nie powiedzie.")
-                return connections
+    # Pozostałe regexy; jeśli się nie skompilowały (None), parsowanie konkretnych pól może zawieść
+    re_lldp_local_port_id = bundle.local_port_id
+    re_lldp_sys_name = bundle.sys_name
+    re_lldp_remote_port_id = bundle.remote_port_id
+    re_lldp_remote_port_desc = bundle.remote_port_desc
+    re_lldp_vlan_id = bundle.vlan_id
 
-    blocks = re_lldp_block_split.split(data_to_parse)
-    if not blocks or (len(blocks) == 1 and not blocks[0].strip()):  # Jeśli split nic nie dał lub tylko pusty string
-        logger.warning(
-            f"CLI-LLDP: Regex 'lldp_regex_block_split' (wzorzec: '{re_lldp_block_split.pattern if re_lldp_block_split else 'None'}') nie podzielił danych LLDP na użyteczne bloki dla {local_hostname}. Dane wejściowe (fragment):\n{data_to_parse[:300]}")
+    # Kluczowe regexy pól muszą być skompilowane - bez nich żaden blok nie da połączenia
+    if not (re_lldp_local_port_id and re_lldp_sys_name and re_lldp_remote_port_id):
+        logger.error(
+            "CLI-LLDP: Jeden lub więcej kluczowych regexów do ekstrakcji pól (local_port, sys_name, remote_port) nie jest skompilowany dla %s. Przerywam parsowanie LLDP.", local_hostname)
+        logger.debug("  Status regexów: local_port_id: %s, sys_name: %s, remote_port_id: %s",
+                     'OK' if re_lldp_local_port_id else 'FAIL', 'OK' if re_lldp_sys_name else 'FAIL',
+                     'OK' if re_lldp_remote_port_id else 'FAIL')
         return connections
 
-    parsed_count = 0
-    for block_content in blocks:
-        block_strip = block_content.strip()
-        if not block_strip or not block_strip.lower().startswith('chassis id:'):
-            if block_strip:
-                logger.debug(
-                    f"CLI-LLDP: Pomijam blok (nie zaczyna się od 'Chassis id:' lub pusty) dla {local_hostname}:\n{block_strip[:100]}...")
-            continue
+    normalize_if = _build_normalizer(config.get('interface_name_replacements', {}))
 
-        # Upewnij się, że kluczowe regexy do ekstrakcji pól są skompilowane
-        if not (re_lldp_local_port_id and re_lldp_sys_name and re_lldp_remote_port_id):
-            logger.error(
-                f"CLI-LLDP: Jeden lub więcej kluczowych regexów do ekstrakcji pól (local_port, sys_name, remote_port) nie jest skompilowany dla {local_hostname}. Pomijam blok.")
-            logger.debug(
-                f"  Status regexów: local_port_id: {'OK' if re_lldp_local_port_id else 'FAIL'}, sys_name: {'OK' if re_lldp_sys_name else 'FAIL'}, remote_port_id: {'OK' if re_lldp_remote_port_id else 'FAIL'}")
+    parsed_count = 0
+    block_count = 0
+    for block_start, block_end in _iter_block_spans(lldp_output, re_lldp_block_split, parse_start):
+        block_count += 1
+        # Typowy nagłówek sprawdź przez startswith na offsecie; regex IGNORECASE tylko dla innej pisowni
+        if not (lldp_output.startswith('Chassis id:', block_start, block_end) or
+                _LLDP_BLOCK_START_RE.match(lldp_output, block_start, block_end)):
+            if logger.isEnabledFor(logging.DEBUG):  # Wycinek bloku tylko przy włączonym DEBUG
+                logger.debug("CLI-LLDP: Pomijam blok (nie zaczyna się od 'Chassis id:' lub pusty) dla %s:\n%s...",
+                             local_hostname, lldp_output[block_start:min(block_end, block_start + 100)])
             continue
 
-        local_if_match = re_lldp_local_port_id.search(block_strip)
-        remote_sys_match = re_lldp_sys_name.search(block_strip)
-        remote_port_id_match = re_lldp_remote_port_id.search(block_strip)
+        local_if_match = re_lldp_local_port_id.search(lldp_output, block_start, block_end)
+        remote_sys_match = re_lldp_sys_name.search(lldp_output, block_start, block_end)
+        remote_port_id_match = re_lldp_remote_port_id.search(lldp_output, block_start, block_end)
 
         if not (local_if_match and remote_sys_match and remote_port_id_match):
-            logger.debug(f"CLI-LLDP: Pominięto blok - brak kluczowych danych w {local_hostname}.")
-            logger.debug(
-                f"  Szczegóły dopasowań: local_if={bool(local_if_match)}, remote_sys={bool(remote_sys_match)}, remote_port_id={bool(remote_port_id_match)}")
-            logger.debug(f"  Przetwarzany blok (fragment):\n{block_strip[:200]}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("CLI-LLDP: Pominięto blok - brak kluczowych danych w %s.", local_hostname)
+                logger.debug("  Szczegóły dopasowań: local_if=%s, remote_sys=%s, remote_port_id=%s",
+                             bool(local_if_match), bool(remote_sys_match), bool(remote_port_id_match))
+                logger.debug("  Przetwarzany blok (fragment):\n%s", lldp_output[block_start:min(block_end, block_start + 200)])
             continue
 
         local_if_raw = local_if_match.group(1).strip()
-        if not local_if_raw or 'not advertised' in local_if_raw.lower(): continue
+        if not local_if_raw or _has_na(local_if_raw): continue
 
-        local_if = _normalize_interface_name(local_if_raw, interface_replacements)
+        local_if = normalize_if(local_if_raw)
         remote_sys = remote_sys_match.group(1).strip()
         remote_port_raw = remote_port_id_match.group(1).strip()
         remote_port_desc_val = ""
 
         if re_lldp_remote_port_desc:  # Sprawdź, czy regex został skompilowany
-            remote_port_desc_match = re_lldp_remote_port_desc.search(block_strip)
+            remote_port_desc_match = re_lldp_remote_port_desc.search(lldp_output, block_start, block_end)
             if remote_port_desc_match:
                 remote_port_desc_val = remote_port_desc_match.group(1).strip()
 
-        chosen_remote_port = remote_port_raw
-        if remote_port_desc_val and 'not advertised' not in remote_port_desc_val.lower():
-            if (not chosen_remote_port or
-                    'not advertised' in chosen_remote_port.lower() or
-                    ':' in chosen_remote_port or
-                    (len(chosen_remote_port) > 20 and not chosen_remote_port.isalnum())
-            ):
-                logger.debug(
-                    f"CLI-LLDP: Dla {local_hostname} -> {remote_sys}: Port ID ('{remote_port_raw}') jest nieoptymalny. Używam Port Description ('{remote_port_desc_val}').")
-                chosen_remote_port = remote_port_desc_val
-            elif chosen_remote_port and chosen_remote_port != remote_port_desc_val and len(remote_port_desc_val) < len(
-                    chosen_remote_port) and not ':' in remote_port_desc_val:
-                logger.debug(
-                    f"CLI-LLDP: Dla {local_hostname} -> {remote_sys}: Port ID ('{remote_port_raw}') i Port Description ('{remote_port_desc_val}') są różne. Używam krótszego Port Description.")
-                chosen_remote_port = remote_port_desc_val
+        chosen_remote_port = _choose_lldp_remote_port(remote_port_raw, remote_port_desc_val)
+        if chosen_remote_port != remote_port_raw:
+            logger.debug(
+                "CLI-LLDP: Dla %s -> %s: Port ID ('%s') jest nieoptymalny lub dłuższy. Używam Port Description ('%s').",
+                local_hostname, remote_sys, remote_port_raw, remote_port_desc_val)
 
-        if not chosen_remote_port or 'not advertised' in chosen_remote_port.lower(): continue
-        remote_if = _normalize_interface_name(chosen_remote_port, interface_replacements)
+        if not chosen_remote_port or _has_na(chosen_remote_port): continue
+        remote_if = normalize_if(chosen_remote_port)
 
         vlan_id_str = None
         if re_lldp_vlan_id:  # Sprawdź, czy regex został skompilowany
-            vlan_match = re_lldp_vlan_id.search(block_strip)
+            vlan_match = re_lldp_vlan_id.search(lldp_output, block_start, block_end)
             if vlan_match and vlan_match.group(1) and vlan_match.group(
                     1).strip():  # Upewnij się, że grupa(1) istnieje przed strip()
                 vlan_id_str = vlan_match.group(1).strip()
@@ -168,81 +437,98 @@ def _parse_lldp_output(lldp_output: str, local_hostname: str, config: Dict[str,
         })
         parsed_count += 1
 
+    if not block_count:
+        logger.warning(
+            "CLI-LLDP: Regex 'lldp_regex_block_split' (wzorzec: '%s') nie podzielił danych LLDP na użyteczne bloki dla %s. Dane wejściowe (fragment):\n%s", re_lldp_block_split.pattern, local_hostname, lldp_output[parse_start:parse_start + 300])
+        return connections
+
     if parsed_count > 0:
-        logger.info(f"✓ CLI-LLDP: Sparsowano {parsed_count} połączeń LLDP dla {local_hostname}.")
-    elif lldp_output and lldp_output.strip():  # Loguj tylko, jeśli było jakieś wyjście
+        logger.info("✓ CLI-LLDP: Sparsowano %s połączeń LLDP dla %s.", parsed_count, local_hostname)
+    elif _NON_SPACE_RE.search(lldp_output):  # Loguj tylko, jeśli było jakieś wyjście
         logger.info(
-            f"ⓘ CLI-LLDP: Otrzymano dane LLDP ({len(lldp_output)} znaków), ale nie sparsowano użytecznych połączeń dla {local_hostname}.")
-        logger.debug(f"CLI-LLDP: Niesparsowane dane LLDP dla {local_hostname} (fragment):\n{lldp_output[:500]}...")
+            "ⓘ CLI-LLDP: Otrzymano dane LLDP (%s znaków), ale nie sparsowano użytecznych połączeń dla %s.", len(lldp_output), local_hostname)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("CLI-LLDP: Niesparsowane dane LLDP dla %s (fragment):\n%s...", local_hostname, lldp_output[:500])
     return connections
 
 
+def _cdp_neighbor_name(device_id: str) -> str:
+    """Skraca Device ID z CDP do nazwy hosta (bez domeny), o ile nie zawiera numeru seryjnego w nawiasie."""
+    if '.' in device_id and '(' not in device_id:
+        return device_id.split('.')[0]
+    return device_id
+
+
 def _parse_cdp_output(cdp_output: str, local_hostname: str, config: Dict[str, Any]) -> List[Dict[str, Any]]:
     connections: List[Dict[str, Any]] = []
     if not cdp_output or "Device ID" not in cdp_output:
-        if cdp_output and "cdp not enabled" in cdp_output.lower():
-            logger.info(f"CLI-CDP: CDP nie jest włączone na {local_hostname}.")
+        if cdp_output and _CDP_NOT_ENABLED_TEXT_RE.search(cdp_output):
+            logger.info("CLI-CDP: CDP nie jest włączone na %s.", local_hostname)
         elif cdp_output:  # Loguj tylko, jeśli było jakieś wyjście
-            logger.info(f"CLI-CDP: Brak 'Device ID' w wyjściu CDP dla {local_hostname}, lub puste wyjście.")
+            logger.info("CLI-CDP: Brak 'Device ID' w wyjściu CDP dla %s, lub puste wyjście.", local_hostname)
+        return connections
+    if "Port ID" not in cdp_output and "Outgoing Port" not in cdp_output:
+        # Wyjście detail zawsze zawiera port sąsiada - bez niego nie ma sensu dzielić na bloki
+        logger.debug("CLI-CDP: Brak 'Port ID' w wyjściu CDP dla %s. Pomijam parsowanie.", local_hostname)
         return connections
-    logger.debug(f"CLI-CDP: Próba parsowania danych CDP dla {local_hostname}...")
+    logger.debug("CLI-CDP: Próba parsowania danych CDP dla %s...", local_hostname)
 
-    cdp_regex_block_split_pattern = config.get('cdp_regex_block_split')
-    re_cdp_block_split = _compile_regex(cdp_regex_block_split_pattern, re.MULTILINE, context="cdp_block_split")
+    bundle = _cdp_regex_bundle(config)
+    cdp_regex_block_split_pattern = bundle.block_split_pattern
+    re_cdp_block_split = bundle.block_split
     if not re_cdp_block_split:
         logger.error(
-            f"CLI-CDP: Krytyczny regex 'cdp_regex_block_split' (wzorzec: '{cdp_regex_block_split_pattern}') nie skompilował się. Przerywam parsowanie CDP dla {local_hostname}.")
+            "CLI-CDP: Krytyczny regex 'cdp_regex_block_split' (wzorzec: '%s') nie skompilował się. Przerywam parsowanie CDP dla %s.", cdp_regex_block_split_pattern, local_hostname)
+        return connections
+
+    re_cdp_device_id = bundle.device_id
+    re_cdp_local_if = bundle.local_if
+    re_cdp_remote_if = bundle.remote_if
+
+    # Kluczowe regexy pól muszą być skompilowane - bez nich żaden blok nie da połączenia
+    if not (re_cdp_device_id and re_cdp_local_if and re_cdp_remote_if):
+        logger.error(
+            "CLI-CDP: Jeden lub więcej kluczowych regexów do ekstrakcji pól (device_id, local_if, remote_if) nie jest skompilowany dla %s. Przerywam parsowanie CDP.", local_hostname)
+        logger.debug("  Status regexów: device_id: %s, local_if: %s, remote_if: %s",
+                     'OK' if re_cdp_device_id else 'FAIL', 'OK' if re_cdp_local_if else 'FAIL',
+                     'OK' if re_cdp_remote_if else 'FAIL')
         return connections
 
-    re_cdp_device_id = _compile_regex(config.get('cdp_regex_device_id'), re.IGNORECASE, context="cdp_device_id")
-    re_cdp_local_if = _compile_regex(config.get('cdp_regex_local_if'), re.IGNORECASE, context="cdp_local_if")
-    re_cdp_remote_if = _compile_regex(config.get('cdp_regex_remote_if'), re.IGNORECASE, context="cdp_remote_if")
-    interface_replacements = config.get('interface_name_replacements', {})
-
-    header_match = re.search(r"Device ID\s*:", cdp_output, re.IGNORECASE)
-    data_to_parse_cdp = cdp_output
-    if header_match:
-        line_start_pos = cdp_output.rfind('\n', 0, header_match.start()) + 1
-        # Użyj skompilowanego regexa do szukania pierwszego bloku
-        first_block_marker_search = re_cdp_block_split.search(cdp_output)
-        if first_block_marker_search and first_block_marker_search.start() < line_start_pos:
-            data_to_parse_cdp = cdp_output[first_block_marker_search.end():].strip()
-            logger.debug(f"CLI-CDP: Usunięto potencjalny nagłówek przed pierwszym blokiem dla {local_hostname}.")
-
-    cdp_blocks = [block.strip() for block in re_cdp_block_split.split(data_to_parse_cdp) if block.strip()]
-    if not cdp_blocks:
+    normalize_if = _build_normalizer(config.get('interface_name_replacements', {}))
+
+    # Nagłówek przed pierwszym separatorem usuń, jeśli żaden "Device ID:" nie występuje przed tym separatorem.
+    # Szukanie ograniczone do tego prefiksu; typowy zapis przez str.find, regex tylko dla odchyleń (wielkość liter, spacje)
+    parse_start = 0  # Offset początku danych w cdp_output - bloki i pola wyszukiwane są na indeksach, bez kopii
+    first_block_marker_search = re_cdp_block_split.search(cdp_output)
+    if first_block_marker_search:
+        header_end = first_block_marker_search.start()
+        if cdp_output.find('Device ID:', 0, header_end) < 0 and \
+                not _CDP_DEVICE_ID_MARKER_RE.search(cdp_output, 0, header_end):
+            parse_start = first_block_marker_search.end()
+            logger.debug("CLI-CDP: Usunięto potencjalny nagłówek przed pierwszym blokiem dla %s.", local_hostname)
+
+    cdp_block_spans = list(_iter_block_spans(cdp_output, re_cdp_block_split, parse_start))
+    if not cdp_block_spans:
         logger.warning(
-            f"CLI-CDP: Regex 'cdp_regex_block_split' (wzorzec: '{re_cdp_block_split.pattern if re_cdp_block_split else 'None'}') nie podzielił danych CDP na użyteczne bloki dla {local_hostname}.")
-        logger.debug(f"CLI-CDP: Dane wejściowe (po ew. usunięciu nagłówka):\n{data_to_parse_cdp[:500]}...")
+            "CLI-CDP: Regex 'cdp_regex_block_split' (wzorzec: '%s') nie podzielił danych CDP na użyteczne bloki dla %s.", re_cdp_block_split.pattern if re_cdp_block_split else 'None', local_hostname)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("CLI-CDP: Dane wejściowe (po ew. usunięciu nagłówka):\n%s...", cdp_output[parse_start:parse_start + 500])
         return connections
 
     parsed_count_cdp = 0
-    for block_idx, block_content in enumerate(cdp_blocks):
-        if not block_content.strip(): continue
-
-        if not (re_cdp_device_id and re_cdp_local_if and re_cdp_remote_if):
-            logger.error(
-                f"CLI-CDP: Jeden lub więcej kluczowych regexów do ekstrakcji pól (device_id, local_if, remote_if) nie jest skompilowany dla {local_hostname}. Pomijam blok.")
-            logger.debug(
-                f"  Status regexów: device_id: {'OK' if re_cdp_device_id else 'FAIL'}, local_if: {'OK' if re_cdp_local_if else 'FAIL'}, remote_if: {'OK' if re_cdp_remote_if else 'FAIL'}")
-            continue
-
-        dev_id_match = re_cdp_device_id.search(block_content)
-        local_if_match = re_cdp_local_if.search(block_content)
-        remote_if_match = re_cdp_remote_if.search(block_content)
+    for block_idx, (block_start, block_end) in enumerate(cdp_block_spans):
+        dev_id_match = re_cdp_device_id.search(cdp_output, block_start, block_end)
+        local_if_match = re_cdp_local_if.search(cdp_output, block_start, block_end)
+        remote_if_match = re_cdp_remote_if.search(cdp_output, block_start, block_end)
 
         if dev_id_match and local_if_match and remote_if_match:
             local_if_raw = local_if_match.group(1).strip().split(',')[0].strip()
-            local_if = _normalize_interface_name(local_if_raw, interface_replacements)
+            local_if = normalize_if(local_if_raw)
 
-            neighbor_host_val_raw = dev_id_match.group(1).strip()
-            if '.' in neighbor_host_val_raw and not '(' in neighbor_host_val_raw:
-                neighbor_host_val = neighbor_host_val_raw.split('.')[0]
-            else:
-                neighbor_host_val = neighbor_host_val_raw
+            neighbor_host_val = _cdp_neighbor_name(dev_id_match.group(1).strip())
 
             remote_if_raw = remote_if_match.group(1).strip()
-            remote_if = _normalize_interface_name(remote_if_raw, interface_replacements)
+            remote_if = normalize_if(remote_if_raw)
 
             if local_if and neighbor_host_val and remote_if:
                 connections.append({
@@ -253,81 +539,789 @@ def _parse_cdp_output(cdp_output: str, local_hostname: str, config: Dict[str, An
                 parsed_count_cdp += 1
             else:
                 logger.debug(
-                    f"CLI-CDP: Pominięto blok {block_idx} - niekompletne dane po normalizacji w {local_hostname}.")
+                    "CLI-CDP: Pominięto blok %s - niekompletne dane po normalizacji w %s.", block_idx, local_hostname)
         else:
-            logger.debug(f"CLI-CDP: Pominięto blok {block_idx} - brak kluczowych danych w {local_hostname}.")
-            logger.debug(
-                f"  Szczegóły dopasowań: dev_id={bool(dev_id_match)}, local_if={bool(local_if_match)}, remote_if={bool(remote_if_match)}")
-            logger.debug(f"  Przetwarzany blok CDP (fragment):\n{block_content[:200]}")
+            if logger.isEnabledFor(logging.DEBUG):  # Wycinek bloku tylko przy włączonym DEBUG
+                logger.debug("CLI-CDP: Pominięto blok %s - brak kluczowych danych w %s.", block_idx, local_hostname)
+                logger.debug("  Szczegóły dopasowań: dev_id=%s, local_if=%s, remote_if=%s",
+                             bool(dev_id_match), bool(local_if_match), bool(remote_if_match))
+                logger.debug("  Przetwarzany blok CDP (fragment):\n%s", cdp_output[block_start:min(block_end, block_start + 200)])
 
     if parsed_count_cdp > 0:
-        logger.info(f"✓ CLI-CDP: Sparsowano {parsed_count_cdp} połączeń CDP dla {local_hostname}.")
-    elif cdp_output and cdp_output.strip() and "cdp not enabled" not in cdp_output.lower():
-        logger.info(f"ⓘ CLI-CDP: Otrzymano dane CDP, ale nie sparsowano użytecznych połączeń dla {local_hostname}.")
-        logger.debug(f"CLI-CDP: Niesparsowane dane CDP dla {local_hostname} (fragment):\n{cdp_output[:500]}...")
+        logger.info("✓ CLI-CDP: Sparsowano %s połączeń CDP dla %s.", parsed_count_cdp, local_hostname)
+    elif _NON_SPACE_RE.search(cdp_output) and not _CDP_NOT_ENABLED_TEXT_RE.search(cdp_output):
+        logger.info("ⓘ CLI-CDP: Otrzymano dane CDP, ale nie sparsowano użytecznych połączeń dla %s.", local_hostname)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("CLI-CDP: Niesparsowane dane CDP dla %s (fragment):\n%s...", local_hostname, cdp_output[:500])
     return connections
 
 
+# --- Parsowanie przez szablony TextFSM z ntc-templates (instalowane razem z Netmiko) ---
+try:
+    import textfsm
+    import ntc_templates
+
+    _NTC_TEMPLATE_DIR: Optional[str] = os.path.join(os.path.dirname(ntc_templates.__file__), "templates")
+except ImportError:
+    textfsm = None
+    _NTC_TEMPLATE_DIR = None
+
+
+class _TextFsmTemplate(NamedTuple):
+    file_name: str
+    local_if: str
+    neighbor: Tuple[str, ...]  # Pola z nazwą sąsiada, w kolejności preferencji
+    port_id: str
+    port_desc: Optional[str]
+    vlan: Optional[str]
+
+
+_IOS_LLDP_TEMPLATE = _TextFsmTemplate("cisco_ios_show_lldp_neighbors_detail.textfsm", "LOCAL_INTERFACE",
+                                      ("NEIGHBOR_NAME",), "NEIGHBOR_PORT_ID", "NEIGHBOR_INTERFACE", "VLAN_ID")
+_IOS_CDP_TEMPLATE = _TextFsmTemplate("cisco_ios_show_cdp_neighbors_detail.textfsm", "LOCAL_INTERFACE",
+                                     ("NEIGHBOR_NAME",), "NEIGHBOR_INTERFACE", None, None)
+_TEXTFSM_TEMPLATES: Dict[Tuple[str, str], _TextFsmTemplate] = {
+    ("cisco_ios", "lldp"): _IOS_LLDP_TEMPLATE,
+    ("cisco_xe", "lldp"): _IOS_LLDP_TEMPLATE,
+    ("cisco_ios", "cdp"): _IOS_CDP_TEMPLATE,
+    ("cisco_xe", "cdp"): _IOS_CDP_TEMPLATE,
+    ("cisco_nxos", "lldp"): _TextFsmTemplate("cisco_nxos_show_lldp_neighbors_detail.textfsm", "LOCAL_INTERFACE",
+                                             ("NEIGHBOR_NAME",), "NEIGHBOR_INTERFACE", None, "VLAN_ID"),
+    ("cisco_nxos", "cdp"): _TextFsmTemplate("cisco_nxos_show_cdp_neighbors_detail.textfsm", "LOCAL_INTERFACE",
+                                            ("CHASSIS_ID", "NEIGHBOR_NAME"), "NEIGHBOR_INTERFACE", None, None),
+}
+_TEXTFSM_LOCAL = threading.local()  # Obiekty TextFSM mają stan - osobne instancje na wątek
+
+
+def _get_textfsm(file_name: str) -> Any:
+    """Zwraca wczytany raz (na wątek) i zresetowany parser TextFSM dla szablonu."""
+    tables = getattr(_TEXTFSM_LOCAL, "tables", None)
+    if tables is None:
+        tables = _TEXTFSM_LOCAL.tables = {}
+    fsm = tables.get(file_name)
+    if fsm is None:
+        with open(os.path.join(_NTC_TEMPLATE_DIR, file_name), encoding="utf-8") as template_file:
+            fsm = tables[file_name] = textfsm.TextFSM(template_file)
+    fsm.Reset()
+    return fsm
+
+
+def _parse_textfsm_rows(template: _TextFsmTemplate, protocol: str, raw_output: str, local_hostname: str,
+                        config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    normalize_if = _build_normalizer(config.get('interface_name_replacements', {}))
+    via = "CLI-LLDP" if protocol == "lldp" else "CLI-CDP"
+    connections: List[Dict[str, Any]] = []
+    for row in _get_textfsm(template.file_name).ParseTextToDicts(raw_output):
+        local_if_raw = row.get(template.local_if, "").strip().split(',')[0].strip()
+        neighbor = next((row[f].strip() for f in template.neighbor if row.get(f, "").strip()), "")
+        port_id = row.get(template.port_id, "").strip()
+        if template.port_desc:
+            port_id = _choose_lldp_remote_port(port_id, row.get(template.port_desc, "").strip())
+        if protocol == "cdp":
+            neighbor = _cdp_neighbor_name(neighbor)
+        if not (local_if_raw and neighbor and port_id) or _has_na(port_id):
+            continue
+        vlan = row.get(template.vlan, "").strip() if template.vlan else ""
+        connections.append({
+            "local_host": local_hostname,
+            "local_if": normalize_if(local_if_raw),
+            "neighbor_host": neighbor,
+            "neighbor_if": normalize_if(port_id),
+            "vlan": vlan or None, "via": via
+        })
+    return connections
+
+
+@functools.lru_cache(maxsize=64)
+def _textfsm_parser(protocol: str, effective_device_type: str) -> Optional[
+        Callable[[str, str, Dict[str, Any]], List[Dict[str, Any]]]]:
+    """Buduje parser TextFSM dla platformy (z fallbackiem na parser regex) lub None, jeśli brak szablonu."""
+    template = _TEXTFSM_TEMPLATES.get((effective_device_type, protocol))
+    if template is None or textfsm is None:
+        return None
+    regex_parser = _parse_lldp_output if protocol == "lldp" else _parse_cdp_output
+
+    def parse(raw_output: str, local_hostname: str, config: Dict[str, Any]) -> List[Dict[str, Any]]:
+        try:
+            connections = _parse_textfsm_rows(template, protocol, raw_output, local_hostname, config)
+        except Exception as e:
+            logger.warning("  CLI: Błąd parsowania TextFSM (%s) dla %s: %s. Używam parsera regex.", template.file_name, local_hostname, e)
+            return regex_parser(raw_output, local_hostname, config)
+        if not connections:
+            logger.debug("  CLI: TextFSM (%s) nie zwrócił połączeń dla %s. Używam parsera regex.", template.file_name, local_hostname)
+            return regex_parser(raw_output, local_hostname, config)
+        logger.info("✓ CLI-%s: Sparsowano %s połączeń (TextFSM) dla %s.", protocol.upper(), len(connections), local_hostname)
+        return connections
+
+    parse.__name__ = f"_parse_{protocol}_textfsm_{effective_device_type}"
+    return parse
+
+
+def _neighbor_parser(protocol: str, effective_device_type: str, config: Dict[str, Any]) -> Callable[
+        [str, str, Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Wybiera parser LLDP/CDP: TextFSM, jeśli cli_parser_engine = textfsm i istnieje szablon dla platformy, inaczej regex.
+    effective_device_type to typ platformy ustalony po 'show version', nie 'autodetect' z sesji Netmiko.
+    """
+    if str(config.get('cli_parser_engine', 'regex')).strip().lower() == "textfsm":
+        parser = _textfsm_parser(protocol, effective_device_type)
+        if parser is not None:
+            return parser
+    return _parse_lldp_output if protocol == "lldp" else _parse_cdp_output
+
+
+def _disable_paging_once(net_connect: Any, plan: CliPlan) -> None:
+    """
+    Wysyła komendy wstępne planu (wyłączenie stronicowania) raz na sesję - sesje ponownie wydane z puli
+    mają znacznik _cli_paging_disabled i pomijają ten krok.
+    """
+    if getattr(net_connect, "_cli_paging_disabled", False):
+        return
+    for pre_cmd, pre_cmd_read_timeout in plan.pre_cmds:
+        try:
+            if pre_cmd_read_timeout is None:
+                net_connect.send_command_timing(pre_cmd)
+            else:
+                net_connect.send_command_timing(pre_cmd, read_timeout=pre_cmd_read_timeout)
+        except Exception as e:
+            logger.warning("  CLI (%s): '%s' nie powiodło się: %s", plan.platform_for_log, pre_cmd, e)
+    net_connect._cli_paging_disabled = True
+
+
+def _retry_if_paged(net_connect: Any, plan: CliPlan, cmd: str, params: Dict[str, Any], raw_output: str,
+                    log: logging.LoggerAdapter) -> str:
+    """
+    Jeśli na początku wyjścia widać pager ('--More--'), przerywa go, ponownie wyłącza stronicowanie
+    i powtarza komendę raz. W przeciwnym razie zwraca raw_output bez zmian.
+    """
+    if not _PAGER_RE.search(raw_output, 0, _PAGER_HEAD_LEN):
+        return raw_output
+    log.warning("Wykryto pager w wyjściu '%s'. Ponownie wyłączam stronicowanie i powtarzam komendę.", cmd)
+    try:
+        net_connect.write_channel("q")
+        net_connect.clear_buffer()
+    except Exception as e_pager:
+        log.debug("Nie udało się przerwać pagera: %s", e_pager)
+    net_connect._cli_paging_disabled = False
+    _disable_paging_once(net_connect, plan)
+    return net_connect.send_command(cmd, **params) or ""
+
+
+def _send_commands_batched(net_connect: Any, commands: List[str], expect_pattern: str,
+                           read_timeout: float) -> List[str]:
+    """
+    Wysyła kilka komend jednym zapisem do kanału i czyta odpowiedź, dzieląc ją na kolejnych wystąpieniach promptu.
+    Prompt jest dopasowywany jako base_prompt sesji na początku linii, więc '#' lub '>' w treści wyjścia
+    (np. w opisie portu sąsiada) nie kończy odczytu. Bez base_prompt używany jest expect_pattern.
+    Zwraca listę wyjść (bez echa komendy i końcowego promptu) w kolejności komend.
+    """
+    base_prompt = getattr(net_connect, "base_prompt", "") or ""
+    if base_prompt:
+        # Kotwica na początku linii, nie na końcu - w paczce echo następnej komendy pojawia się tuż za promptem
+        prompt_pattern = r"^" + re.escape(base_prompt) + r"[#>]"
+    else:
+        prompt_pattern = expect_pattern
+    net_connect.write_channel("".join(net_connect.normalize_cmd(cmd) for cmd in commands))
+    outputs: List[str] = []
+    for _ in commands:
+        chunk = net_connect.read_until_pattern(pattern=prompt_pattern, read_timeout=read_timeout,
+                                               re_flags=re.MULTILINE)
+        # Pierwsza linia to echo komendy, ostatnia to prompt, po którym zakończono odczyt
+        lines = chunk.strip("\r\n").splitlines()
+        outputs.append("\n".join(lines[1:-1]) if len(lines) > 2 else "")
+    return outputs
+
+
+def _exec_parallel_channels(net_connect: Any, commands: List[str], read_timeout: float) -> List[str]:
+    """
+    Uruchamia komendy równolegle, każdą w osobnym kanale exec na istniejącym transporcie SSH sesji Netmiko.
+    Zwraca listę wyjść w kolejności komend. Rzuca wyjątek, jeśli transport lub urządzenie nie obsługuje kanałów exec.
+    """
+    transport = net_connect.remote_conn.get_transport()
+    channels = []
+    try:
+        for cmd in commands:
+            channel = transport.open_session()
+            channel.settimeout(read_timeout)
+            channel.exec_command(cmd)
+            channels.append(channel)
+
+        buffers: List[List[bytes]] = [[] for _ in channels]
+        pending = set(range(len(channels)))
+        deadline = time.monotonic() + read_timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Przekroczono {read_timeout}s oczekiwania na kanały exec")
+            ready, _, _ = select.select([channels[i] for i in pending], [], [], remaining)
+            for channel in ready:
+                idx = channels.index(channel)
+                data = channel.recv(65536)
+                if data:
+                    buffers[idx].append(data)
+                else:  # EOF - komenda zakończona
+                    pending.discard(idx)
+        return [b"".join(chunks).decode("utf-8", "replace") for chunks in buffers]
+    finally:
+        for channel in channels:
+            channel.close()
+
+
+# --- Cache wyników parsowania ---
+CLI_PARSE_CACHE_SIZE = 2048  # Liczba zapamiętanych wyników parsowania LLDP/CDP (klucz: hash surowego wyjścia)
+
+_PARSE_CACHE: "OrderedDict[Tuple[str, bytes, str], Tuple[Dict[str, Any], ...]]" = OrderedDict()
+_PARSE_CACHE_LOCK = threading.Lock()
+
+CLI_PARSE_DISK_CACHE_TTL = 86400  # Sekundy; starsze wpisy cache na dysku są ignorowane i usuwane
+CLI_PARSE_DISK_CACHE_SIZE = 20000  # Maksymalna liczba wpisów cache na dysku; nadmiarowe usuwane wg LRU
+_PARSE_CONFIG_KEYS = ('lldp_regex_', 'cdp_regex_', 'interface_name_replacements')
+
+
+def _parser_config_fingerprint(config: Dict[str, Any]) -> str:
+    """Skrót ustawień wpływających na wynik parserów - zmiana regexów w config unieważnia cache na dysku."""
+    relevant = sorted((k, str(v)) for k, v in config.items() if k.startswith(_PARSE_CONFIG_KEYS))
+    return hashlib.blake2b(repr(relevant).encode("utf-8"), digest_size=8).hexdigest()
+
+
+class _DiskParseCache:
+    """
+    Cache parsowania na dysku (shelve) z osobnym indeksem klucz -> czas zapisu, trzymanym pod jednym kluczem.
+    Przy otwarciu wczytywany jest tylko indeks i lista kluczy, nie wartości wpisów; TTL sprawdzany jest przy odczycie,
+    a po przekroczeniu max_entries usuwane są najdawniej używane wpisy. Wywoływać pod _PARSE_CACHE_LOCK.
+    """
+    _INDEX_KEY = "__index__"
+
+    def __init__(self, shelf: shelve.Shelf, ttl: float, max_entries: int):
+        self.shelf = shelf
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._index_dirty = False
+        try:
+            index = shelf.get(self._INDEX_KEY)
+        except (pickle.UnpicklingError, EOFError, ValueError) as e:
+            logger.warning("  CLI: Uszkodzony indeks cache parsowania na dysku (%s). Zaczynam od pustego indeksu.", e)
+            index = None
+        self._index: "OrderedDict[str, float]" = index if isinstance(index, OrderedDict) else OrderedDict()
+        # Indeks zapisywany jest przy zamknięciu - po awarii wpisy z przerwanego uruchomienia nie mają go w indeksie.
+        # Przegląd samych kluczy (bez odczytu wartości) usuwa takie osierocone wpisy, więc plik nie rośnie bez końca
+        orphans = [k for k in shelf.keys() if k != self._INDEX_KEY and k not in self._index]
+        for k in orphans:
+            self._drop(k)
+        now = time.time()
+        expired = [k for k, saved_at in self._index.items() if now - saved_at > ttl]
+        for k in expired:
+            self._drop(k)
+        self._evict()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], ...]]:
+        saved_at = self._index.get(key)
+        if saved_at is None:
+            return None
+        if time.time() - saved_at > self.ttl:
+            self._drop(key)
+            return None
+        try:
+            entry = self.shelf.get(key)
+        except (pickle.UnpicklingError, EOFError, ValueError) as e:
+            logger.warning("  CLI: Uszkodzony wpis cache parsowania na dysku (%s). Usuwam go.", e)
+            self._drop(key)
+            return None
+        if entry is None:
+            self._drop(key)
+            return None
+        self._index.move_to_end(key)
+        self._index_dirty = True
+        return entry
+
+    def put(self, key: str, connections: Tuple[Dict[str, Any], ...]) -> None:
+        self.shelf[key] = connections
+        self._index[key] = time.time()
+        self._index.move_to_end(key)
+        self._index_dirty = True
+        self._evict()
+
+    def close(self) -> None:
+        try:
+            if self._index_dirty:
+                self.shelf[self._INDEX_KEY] = self._index
+        finally:
+            self.shelf.close()
+
+    def _evict(self) -> None:
+        while len(self._index) > self.max_entries:
+            self._drop(next(iter(self._index)))
+
+    def _drop(self, key: str) -> None:
+        self._index.pop(key, None)
+        self._index_dirty = True
+        try:
+            del self.shelf[key]
+        except KeyError:
+            pass
+
+
+_DISK_CACHES: Dict[str, Optional[_DiskParseCache]] = {}
+
+
+def _get_disk_cache(cache_dir: str) -> Optional[_DiskParseCache]:
+    """Otwiera (raz na katalog) plik shelve z cache parsowania. Wywoływać pod _PARSE_CACHE_LOCK."""
+    if cache_dir in _DISK_CACHES:
+        return _DISK_CACHES[cache_dir]
+    disk_cache: Optional[_DiskParseCache] = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        shelf = shelve.open(os.path.join(cache_dir, "cli_parse_cache"))
+        disk_cache = _DiskParseCache(shelf, CLI_PARSE_DISK_CACHE_TTL, CLI_PARSE_DISK_CACHE_SIZE)
+        logger.info("  CLI: Cache parsowania na dysku: '%s' (%s wpisów).", cache_dir, len(disk_cache))
+    except (OSError, dbm.error) as e:
+        logger.warning("  CLI: Nie udało się otworzyć cache parsowania w '%s': %s. Cache na dysku wyłączony.", cache_dir, e)
+        disk_cache = None
+    _DISK_CACHES[cache_dir] = disk_cache
+    return disk_cache
+
+
+def _close_disk_caches() -> None:
+    with _PARSE_CACHE_LOCK:
+        for disk_cache in _DISK_CACHES.values():
+            if disk_cache is not None:
+                try:
+                    disk_cache.close()
+                except Exception as e:
+                    logger.debug("  CLI: Błąd zamykania cache parsowania: %s", e)
+        _DISK_CACHES.clear()
+
+
+atexit.register(_close_disk_caches)
+
+
+def _add_connections(target: Dict[Tuple[Any, ...], Dict[str, Any]], connections: Iterable[Dict[str, Any]]) -> None:
+    """
+    Dodaje połączenia do słownika kluczowanego (lokalny port, sąsiad, port sąsiada), pomijając duplikaty.
+    Nazwa sąsiada w kluczu jest skracana jak w CDP, więc FQDN z LLDP i krótka nazwa z CDP dają ten sam klucz.
+    """
+    for conn in connections:
+        neighbor_host = conn.get("neighbor_host")
+        if isinstance(neighbor_host, str):
+            neighbor_host = _cdp_neighbor_name(neighbor_host)
+        target.setdefault((conn.get("local_if"), neighbor_host, conn.get("neighbor_if")), conn)
+
+
+def _parse_cached(parser: Callable[[str, str, Dict[str, Any]], List[Dict[str, Any]]], raw_output: str,
+                  local_hostname: str, config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Parsuje wyjście LLDP/CDP, zapamiętując wynik dla identycznego surowego wyjścia z tego samego hosta.
+    Przy trafieniu zwraca kopie słowników, więc wywołujący może je modyfikować.
+    Zakłada, że regexy parsowania w config nie zmieniają się w trakcie działania programu.
+    Jeśli ustawiono cli_cache_dir, wyniki są też trwale zapisywane na dysku między uruchomieniami.
+    """
+    digest = hashlib.blake2b(raw_output.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    key = (parser.__name__, digest, local_hostname)
+    cache_dir = str(config.get('cli_cache_dir') or "").strip()
+    disk_key = f"{parser.__name__}:{local_hostname}:{digest.hex()}:{_parser_config_fingerprint(config)}" if cache_dir else ""
+    with _PARSE_CACHE_LOCK:
+        cached = _PARSE_CACHE.get(key)
+        if cached is not None:
+            _PARSE_CACHE.move_to_end(key)
+        elif cache_dir:
+            disk_cache = _get_disk_cache(cache_dir)
+            cached = disk_cache.get(disk_key) if disk_cache is not None else None
+            if cached is not None:
+                _PARSE_CACHE[key] = cached
+    if cached is not None:
+        logger.debug("  CLI: Wynik %s dla %s z cache (wyjście bez zmian).", parser.__name__, local_hostname)
+        return [dict(conn) for conn in cached]
+
+    connections = parser(raw_output, local_hostname, config)
+    with _PARSE_CACHE_LOCK:
+        _PARSE_CACHE[key] = tuple(dict(conn) for conn in connections)
+        if len(_PARSE_CACHE) > CLI_PARSE_CACHE_SIZE:
+            _PARSE_CACHE.popitem(last=False)
+        if cache_dir:
+            disk_cache = _get_disk_cache(cache_dir)
+            if disk_cache is not None:
+                try:
+                    disk_cache.put(disk_key, _PARSE_CACHE[key])
+                except Exception as e:
+                    logger.warning("  CLI: Nie udało się zapisać wyniku parsowania do cache na dysku: %s", e)
+    return connections
+
+
+# --- Cache możliwości urządzeń (obsługa LLDP/CDP per host i typ platformy) ---
+CLI_CAPABILITY_TTL = 7 * 86400  # Sekundy, po których zapamiętana obsługa protokołów jest sprawdzana ponownie
+_CAPABILITY_FILE = "cli_capabilities.json"
+_CAPABILITY_LOCK = threading.Lock()
+_CAPABILITY_STORES: Dict[str, Dict[str, Dict[str, Any]]] = {}  # cli_cache_dir ("" = tylko pamięć) -> wpisy
+_CAPABILITY_DIRTY: Set[str] = set()
+
+
+def _capability_store(cache_dir: str) -> Dict[str, Dict[str, Any]]:
+    """Zwraca (wczytując raz z pliku JSON w cache_dir) słownik możliwości. Wywoływać pod _CAPABILITY_LOCK."""
+    store = _CAPABILITY_STORES.get(cache_dir)
+    if store is None:
+        store = {}
+        if cache_dir:
+            try:
+                with open(os.path.join(cache_dir, _CAPABILITY_FILE), "r", encoding="utf-8") as f:
+                    store = json.load(f)
+                logger.debug("  CLI: Wczytano cache możliwości urządzeń (%s wpisów) z '%s'.", len(store), cache_dir)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.warning("  CLI: Nie udało się wczytać cache możliwości urządzeń z '%s': %s", cache_dir, e)
+        _CAPABILITY_STORES[cache_dir] = store
+    return store
+
+
+def _get_capabilities(host: str, device_type: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Zapamiętane możliwości hosta: {'lldp': bool, 'cdp': bool, 'lldp_cmd': str}; pusty słownik, gdy brak lub wygasły.
+    Klucz zawiera typ platformy, więc wymiana urządzenia pod tym samym adresem unieważnia wpis.
+    """
+    cache_dir = str(config.get('cli_cache_dir') or "").strip()
+    with _CAPABILITY_LOCK:
+        entry = _capability_store(cache_dir).get(f"{host}|{device_type}")
+        if not entry or time.time() - entry.get("ts", 0) > CLI_CAPABILITY_TTL:
+            return {}
+        return dict(entry)
+
+
+def _record_capability(host: str, device_type: str, config: Dict[str, Any], **updates: Any) -> None:
+    cache_dir = str(config.get('cli_cache_dir') or "").strip()
+    with _CAPABILITY_LOCK:
+        store = _capability_store(cache_dir)
+        entry = store.setdefault(f"{host}|{device_type}", {})
+        if any(entry.get(k) != v for k, v in updates.items()) or time.time() - entry.get("ts", 0) > CLI_CAPABILITY_TTL:
+            entry.update(updates)
+            entry["ts"] = time.time()
+            _CAPABILITY_DIRTY.add(cache_dir)
+
+
+def _save_capabilities() -> None:
+    """Zapisuje zmienione cache możliwości atomowo (plik tymczasowy + os.replace)."""
+    with _CAPABILITY_LOCK:
+        for cache_dir in _CAPABILITY_DIRTY:
+            if not cache_dir:
+                continue
+            tmp_path = None
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(prefix=_CAPABILITY_FILE, dir=cache_dir)
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(_CAPABILITY_STORES[cache_dir], f)
+                os.replace(tmp_path, os.path.join(cache_dir, _CAPABILITY_FILE))
+            except OSError as e:
+                logger.warning("  CLI: Nie udało się zapisać cache możliwości urządzeń w '%s': %s", cache_dir, e)
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        _CAPABILITY_DIRTY.clear()
+
+
+atexit.register(_save_capabilities)
+
+
+class _CliProtoLogAdapter(logging.LoggerAdapter):
+    """
+    Dokleja prefiks '  CLI-<proto>: ' do komunikatów i przekazuje proto/cli_host jako extra rekordu.
+    process() wywoływane jest tylko dla rekordów, które przeszły filtr poziomu logowania.
+    """
+
+    def process(self, msg: Any, kwargs: Any) -> Tuple[Any, Any]:
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return f"  CLI-{self.extra['proto']}: {msg}", kwargs
+
+
+class _RedactedParams:
+    """Leniwa reprezentacja parametrów połączenia bez hasła - słownik budowany dopiero przy formatowaniu rekordu."""
+    __slots__ = ("params",)
+
+    def __init__(self, params: Dict[str, Any]):
+        self.params = params
+
+    def __repr__(self) -> str:
+        return repr({k: v for k, v in self.params.items() if k != 'password'})
+
+    __str__ = __repr__
+
+
+# --- Pula połączeń Netmiko ---
+CLI_POOL_IDLE_TIMEOUT = 300  # Sekundy bezczynności, po których sesja z puli jest zamykana
+CLI_POOL_MAX_AGE = 3600  # Maksymalny wiek sesji (s); starsze nie są ponownie wydawane
+CLI_POOL_MAX_CONNECTIONS = 128  # Limit jednocześnie otwartych sesji z puli (używanych i bezczynnych)
+
+
+class _ConnectionPool:
+    """
+    Pula bezczynnych sesji Netmiko kluczowana (host, port, użytkownik, device_type).
+    Sesja jest wydawana tylko jednemu wywołującemu naraz; przed ponownym użyciem sprawdzana przez find_prompt().
+    Liczbę otwartych sesji ogranicza semafor; przy braku miejsca zamykana jest najdawniej zwrócona bezczynna sesja.
+    """
+
+    def __init__(self, idle_timeout: float, max_age: float, max_connections: int):
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[Any, ...], List[Tuple[Any, float]]] = {}  # klucz -> [(sesja, czas zwrotu)]
+        self._created_at: Dict[int, float] = {}  # id(sesji) -> czas utworzenia
+        self._reaper: Optional[threading.Thread] = None
+
+    @staticmethod
+    def key_for(device_params: Dict[str, Any]) -> Tuple[Any, ...]:
+        return (device_params.get("host"), device_params.get("port", 22), device_params.get("username"),
+                device_params.get("device_type"))
+
+    def acquire(self, key: Tuple[Any, ...], device_params: Dict[str, Any]) -> Any:
+        while True:
+            with self._lock:
+                bucket = self._idle.get(key)
+                entry = bucket.pop() if bucket else None
+                created_at = self._created_at.get(id(entry[0]), 0.0) if entry else 0.0
+            if entry is None:
+                break
+            net_connect = entry[0]
+            if time.monotonic() - created_at > self.max_age:
+                logger.debug("  CLI-Pool: Sesja dla %s przekroczyła max_age (%ss). Zamykam.", key[0], self.max_age)
+                self._close(net_connect)
+                continue
+            if self._is_responsive(net_connect, key):
+                logger.info("  CLI-Pool: Ponowne użycie sesji Netmiko dla %s.", key[0])
+                return net_connect
+            self._close(net_connect)
+
+        self._acquire_slot()
+        try:
+            net_connect = ConnectHandler(**device_params)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._created_at[id(net_connect)] = time.monotonic()
+        self._ensure_reaper()
+        return net_connect
+
+    @staticmethod
+    def _is_responsive(net_connect: Any, key: Tuple[Any, ...]) -> bool:
+        """find_prompt() z jedną ponowną próbą - pojedynczy zgubiony odczyt nie powoduje zamknięcia sesji."""
+        for attempt in (1, 2):
+            try:
+                net_connect.find_prompt()
+                return True
+            except Exception as e_probe:
+                logger.info("  CLI-Pool: Sesja z puli dla %s nie odpowiada (próba %s/2: %s).", key[0], attempt, e_probe)
+        logger.info("  CLI-Pool: Usuwam z puli niedziałającą sesję dla %s.", key[0])
+        return False
+
+    def _acquire_slot(self) -> None:
+        """Czeka na wolne miejsce w limicie sesji, zamykając w razie potrzeby najdawniej zwróconą bezczynną sesję."""
+        while not self._slots.acquire(timeout=1.0):
+            with self._lock:
+                oldest_key, oldest_idx, oldest_at = None, -1, float("inf")
+                for key, bucket in self._idle.items():
+                    for idx, (_, released_at) in enumerate(bucket):
+                        if released_at < oldest_at:
+                            oldest_key, oldest_idx, oldest_at = key, idx, released_at
+                victim = self._idle[oldest_key].pop(oldest_idx)[0] if oldest_key is not None else None
+                if oldest_key is not None and not self._idle[oldest_key]:
+                    del self._idle[oldest_key]
+            if victim is not None:
+                logger.debug("  CLI-Pool: Limit sesji osiągnięty. Zamykam bezczynną sesję dla %s.", oldest_key[0])
+                self._close(victim)
+
+    def discard(self, net_connect: Any) -> None:
+        """Zamyka sesję wydaną z puli, która nie nadaje się do zwrotu (np. po błędzie połączenia)."""
+        self._close(net_connect)
+
+    def release(self, key: Tuple[Any, ...], net_connect: Any) -> None:
+        try:
+            if net_connect.check_config_mode():
+                net_connect.exit_config_mode()
+        except Exception as e_reset:
+            logger.info("  CLI-Pool: Nie udało się przywrócić sesji dla %s do trybu wyjściowego (%s). Zamykam.", key[0], e_reset)
+            self._close(net_connect)
+            return
+        with self._lock:
+            self._idle.setdefault(key, []).append((net_connect, time.monotonic()))
+
+    def evict_expired(self) -> None:
+        now = time.monotonic()
+        expired: List[Any] = []
+        with self._lock:
+            for key in list(self._idle):
+                keep = []
+                for net_connect, released_at in self._idle[key]:
+                    if now - released_at > self.idle_timeout or \
+                            now - self._created_at.get(id(net_connect), now) > self.max_age:
+                        expired.append(net_connect)
+                    else:
+                        keep.append((net_connect, released_at))
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+        for net_connect in expired:
+            self._close(net_connect)
+
+    def close_all(self) -> None:
+        with self._lock:
+            all_idle = [net_connect for bucket in self._idle.values() for net_connect, _ in bucket]
+            self._idle.clear()
+        for net_connect in all_idle:
+            self._close(net_connect)
+
+    def _close(self, net_connect: Any) -> None:
+        with self._lock:
+            pooled = self._created_at.pop(id(net_connect), None) is not None
+        if pooled:
+            self._slots.release()
+        try:
+            net_connect.disconnect()
+        except Exception as e_disc:
+            logger.debug("  CLI-Pool: Błąd rozłączenia sesji z puli: %s", e_disc)
+
+    def _ensure_reaper(self) -> None:
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reaper_loop, name="cli-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reaper_loop(self) -> None:
+        while True:
+            time.sleep(min(self.idle_timeout, 60))
+            self.evict_expired()
+
+
+_POOL = _ConnectionPool(CLI_POOL_IDLE_TIMEOUT, CLI_POOL_MAX_AGE, CLI_POOL_MAX_CONNECTIONS)
+atexit.register(_POOL.close_all)
+
+
+class _BackgroundDisconnector:
+    """
+    Zamyka sesje Netmiko w wątku w tle - zamknięcie kanału i TCP nie blokuje wątku, który zwraca wyniki.
+    Przy wyjściu z programu pozostałe w kolejce sesje zamykane są synchronicznie (domknięcie logów sesji).
+    """
+
+    def __init__(self) -> None:
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def submit(self, net_connect: Any) -> None:
+        self._queue.put(net_connect)
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._worker = threading.Thread(target=self._worker_loop, name="cli-disconnect", daemon=True)
+        self._worker.start()
+
+    def drain(self) -> None:
+        while True:
+            try:
+                net_connect = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._disconnect(net_connect)
+
+    @staticmethod
+    def _disconnect(net_connect: Any) -> None:
+        try:
+            net_connect.disconnect()
+        except Exception as e_disc:
+            logger.debug("  CLI: Błąd rozłączenia sesji w tle: %s", e_disc)
+
+    def _worker_loop(self) -> None:
+        while True:
+            self._disconnect(self._queue.get())
+
+
+_DISCONNECTOR = _BackgroundDisconnector()
+atexit.register(_DISCONNECTOR.drain)
+
+# Katalogi logów sesji już utworzone/sprawdzone w tym procesie (makedirs z exist_ok jest bezpieczne między wątkami)
+_ENSURED_DIRS: Set[str] = set()
+
+
 def cli_get_neighbors_enhanced(host: str, username: str, password: str, config: Dict[str, Any]) -> List[Dict[str, Any]]:
     if not host or not username or not password:
-        logger.warning(f"CLI: Brak danych logowania dla '{host}'. Pomijam.")
+        logger.warning("CLI: Brak danych logowania dla '%s'. Pomijam.", host)
         return []
 
-    logger.info(f"⟶ CLI: Próba odkrycia sąsiadów dla {host}")
+    # Bez cli_verbose_log kroki pośrednie idą na DEBUG, a na INFO trafia jeden rekord podsumowania na host
+    verbose = bool(config.get('cli_verbose_log', True))
+    step_level = logging.INFO if verbose else logging.DEBUG
+    step_log = functools.partial(logger.log, step_level)
+    lldp_log = _CliProtoLogAdapter(logger, {"proto": "LLDP", "cli_host": host})
+    cdp_log = _CliProtoLogAdapter(logger, {"proto": "CDP", "cli_host": host})
+    nxos_fb_log = _CliProtoLogAdapter(logger, {"proto": "LLDP (fallback NXOS)", "cli_host": host})
+    lldp_step = functools.partial(lldp_log.log, step_level)
+    cdp_step = functools.partial(cdp_log.log, step_level)
+    nxos_fb_step = functools.partial(nxos_fb_log.log, step_level)
+    trace: Dict[str, Any] = {"host": host, "device_type": None, "lldp_count": 0, "cdp_count": 0, "errors": []}
 
-    # --- Netmiko Session Log Setup ---
-    raw_template_from_config = config.get('cli_netmiko_session_log_template')
-    logger.info(f"  CLI: Diagnostyka logów Netmiko dla {host}:")  # Zmieniono na INFO dla widoczności
-    logger.info(
-        f"    1. Surowa wartość z config['cli_netmiko_session_log_template'] = '{raw_template_from_config}' (typ: {type(raw_template_from_config)})")
+    step_log("⟶ CLI: Próba odkrycia sąsiadów dla %s", host)
 
+    # --- Netmiko Session Log Setup ---
     session_log_path = None
-    # Upewnij się, że szablon jest stringiem i usuń białe znaki przed sprawdzeniem, czy nie jest pusty
-    netmiko_session_log_template_val = str(raw_template_from_config or "").strip()
-    logger.info(f"    2. Wartość szablonu po str() i strip(): '{netmiko_session_log_template_val}'")
+    if not config.get('cli_netmiko_session_log_enabled', True):
+        # Bez logu sesji Netmiko nie pisze pliku dla każdego hosta - pomijamy też budowę ścieżki i katalogu
+        step_log("  CLI: Logowanie sesji Netmiko wyłączone (netmiko_session_log_enabled = False) dla %s.", host)
+    else:
+        raw_template_from_config = config.get('cli_netmiko_session_log_template')
+        step_log("  CLI: Diagnostyka logów Netmiko dla %s:", host)  # Zmieniono na INFO dla widoczności
+        step_log(
+            "    1. Surowa wartość z config['cli_netmiko_session_log_template'] = '%s' (typ: %s)", raw_template_from_config, type(raw_template_from_config))
 
-    if not netmiko_session_log_template_val:
-        logger.warning(
-            f"  CLI: Szablon logu sesji Netmiko jest PUSTY. Próba użycia awaryjnego szablonu: '{EMERGENCY_NETMIKO_LOG_TEMPLATE}'")
-        netmiko_session_log_template_val = EMERGENCY_NETMIKO_LOG_TEMPLATE
+        # Upewnij się, że szablon jest stringiem i usuń białe znaki przed sprawdzeniem, czy nie jest pusty
+        netmiko_session_log_template_val = str(raw_template_from_config or "").strip()
+        step_log("    2. Wartość szablonu po str() i strip(): '%s'", netmiko_session_log_template_val)
 
-    try:
-        # Oczyść nazwę hosta dla ścieżki: zamień znaki inne niż alfanumeryczne (bez kropki, myślnika) na podkreślenie
-        host_sanitized_for_log_path = re.sub(r'[^\w\.-]', '_', host)
-        session_log_path = netmiko_session_log_template_val.format(host=host_sanitized_for_log_path)
-        logger.info(f"    3. Potencjalna ścieżka logu po formatowaniu: '{session_log_path}'")
-
-        if session_log_path:  # Sprawdź, czy konstrukcja ścieżki się powiodła
-            log_dir = os.path.dirname(session_log_path)
-            if log_dir and not os.path.exists(log_dir):  # Jeśli część katalogowa istnieje i katalog nie istnieje
-                try:
-                    os.makedirs(log_dir, exist_ok=True)
-                    logger.info(f"    4. Utworzono katalog dla logów Netmiko: '{log_dir}'")
-                except OSError as e_mkdir:
-                    logger.error(
-                        f"    4. BŁĄD: Nie udało się utworzyć katalogu '{log_dir}': {e_mkdir}. Logowanie sesji Netmiko wyłączone.")
-                    session_log_path = None  # Wyłącz, jeśli tworzenie katalogu się nie powiedzie
-            elif not log_dir:  # Plik logu w bieżącym katalogu, nie trzeba tworzyć katalogu
-                logger.debug(f"    4. Plik logu Netmiko '{session_log_path}' będzie w bieżącym katalogu roboczym.")
-        else:  # session_log_path stał się pusty po formatowaniu (mało prawdopodobne z obecną logiką oczyszczania)
+        if not netmiko_session_log_template_val:
             logger.warning(
-                f"    3. BŁĄD: session_log_path jest pusty po formatowaniu szablonu '{netmiko_session_log_template_val}'. Logowanie Netmiko wyłączone.")
-            session_log_path = None  # Upewnij się, że jest None, jeśli ścieżka jest pusta
+                "  CLI: Szablon logu sesji Netmiko jest PUSTY. Próba użycia awaryjnego szablonu: '%s'", EMERGENCY_NETMIKO_LOG_TEMPLATE)
+            netmiko_session_log_template_val = EMERGENCY_NETMIKO_LOG_TEMPLATE
 
-        if session_log_path:  # Sprawdź ponownie po potencjalnym niepowodzeniu tworzenia katalogu
-            logger.info(f"    5. Finalna ścieżka logu Netmiko: '{session_log_path}'")
-        else:
-            logger.warning(f"    5. Finalnie logowanie Netmiko jest WYŁĄCZONE dla {host}.")
+        try:
+            # Oczyść nazwę hosta dla ścieżki: zamień znaki inne niż alfanumeryczne (bez kropki, myślnika) na podkreślenie
+            host_sanitized_for_log_path = _HOST_SANITIZE_RE.sub('_', host)
+            session_log_path = netmiko_session_log_template_val.format(host=host_sanitized_for_log_path)
+            step_log("    3. Potencjalna ścieżka logu po formatowaniu: '%s'", session_log_path)
+
+            if session_log_path:  # Sprawdź, czy konstrukcja ścieżki się powiodła
+                log_dir = os.path.dirname(session_log_path)
+                if log_dir and log_dir not in _ENSURED_DIRS:  # Katalog nie był jeszcze sprawdzany w tym procesie
+                    try:
+                        os.makedirs(log_dir, exist_ok=True)
+                        _ENSURED_DIRS.add(log_dir)
+                        step_log("    4. Katalog dla logów Netmiko gotowy: '%s'", log_dir)
+                    except OSError as e_mkdir:
+                        logger.error(
+                            "    4. BŁĄD: Nie udało się utworzyć katalogu '%s': %s. Logowanie sesji Netmiko wyłączone.", log_dir, e_mkdir)
+                        session_log_path = None  # Wyłącz, jeśli tworzenie katalogu się nie powiedzie
+                elif not log_dir:  # Plik logu w bieżącym katalogu, nie trzeba tworzyć katalogu
+                    logger.debug("    4. Plik logu Netmiko '%s' będzie w bieżącym katalogu roboczym.", session_log_path)
+            else:  # session_log_path stał się pusty po formatowaniu (mało prawdopodobne z obecną logiką oczyszczania)
+                logger.warning(
+                    "    3. BŁĄD: session_log_path jest pusty po formatowaniu szablonu '%s'. Logowanie Netmiko wyłączone.", netmiko_session_log_template_val)
+                session_log_path = None  # Upewnij się, że jest None, jeśli ścieżka jest pusta
 
-    except KeyError as e_log_format:
-        logger.warning(
-            f"  CLI: Błąd formatowania szablonu logu Netmiko ('{netmiko_session_log_template_val}') dla hosta '{host}': {e_log_format}. Logowanie Netmiko wyłączone.")
-        session_log_path = None
-    except Exception as e_log_path_generic:  # Złap inne nieoczekiwane błędy
-        logger.error(
-            f"  CLI: Nieoczekiwany błąd przy tworzeniu ścieżki logu Netmiko z szablonu '{netmiko_session_log_template_val}' dla hosta '{host}': {e_log_path_generic}. Logowanie Netmiko wyłączone.",
-            exc_info=True)
-        session_log_path = None
+            if session_log_path:  # Sprawdź ponownie po potencjalnym niepowodzeniu tworzenia katalogu
+                step_log("    5. Finalna ścieżka logu Netmiko: '%s'", session_log_path)
+            else:
+                logger.warning("    5. Finalnie logowanie Netmiko jest WYŁĄCZONE dla %s.", host)
+
+        except KeyError as e_log_format:
+            logger.warning(
+                "  CLI: Błąd formatowania szablonu logu Netmiko ('%s') dla hosta '%s': %s. Logowanie Netmiko wyłączone.", netmiko_session_log_template_val, host, e_log_format)
+            session_log_path = None
+        except Exception as e_log_path_generic:  # Złap inne nieoczekiwane błędy
+            logger.error(
+                "  CLI: Nieoczekiwany błąd przy tworzeniu ścieżki logu Netmiko z szablonu '%s' dla hosta '%s': %s. Logowanie Netmiko wyłączone.", netmiko_session_log_template_val, host, e_log_path_generic,
+                exc_info=True)
+            session_log_path = None
     # --- Koniec konfiguracji logów sesji Netmiko ---
 
     device_params: Dict[str, Any] = {
@@ -341,6 +1335,14 @@ def cli_get_neighbors_enhanced(host: str, username: str, password: str, config:
         "auth_timeout": config.get('cli_auth_timeout', 90),
         "banner_timeout": config.get('cli_banner_timeout', 75)
     }
+    if config.get('cli_fast_mode', False):
+        # Tryb szybki: krótsze uśpienia Netmiko przy logowaniu i wykrywaniu promptu (może nie działać na wolnych platformach)
+        device_params.update({
+            "fast_cli": True,
+            "global_delay_factor": config.get('cli_fast_global_delay_factor', 0.1),
+            "auth_timeout": min(device_params["auth_timeout"], 15),
+            "banner_timeout": min(device_params["banner_timeout"], 10),
+        })
     if session_log_path:  # Dodaj tylko, jeśli ścieżka jest prawidłowa i niepusta
         device_params["session_log"] = session_log_path
     else:
@@ -348,11 +1350,15 @@ def cli_get_neighbors_enhanced(host: str, username: str, password: str, config:
         # Komunikat logowania został już wygenerowany wyżej, jeśli logowanie jest wyłączone
 
     # Loguj finalne parametry przed połączeniem (pomijając hasło dla bezpieczeństwa)
-    params_to_log = {k: v for k, v in device_params.items() if k != 'password'}
-    logger.info(f"  CLI: Parametry dla ConnectHandler (hasło pominięte): {params_to_log}")
+    step_log("  CLI: Parametry dla ConnectHandler (hasło pominięte): %s", _RedactedParams(device_params))
 
-    all_cli_connections: List[Dict[str, Any]] = []
+    # Kluczowane (local_if, neighbor_host, neighbor_if) - to samo łącze z LLDP i fallbacku NX-OS liczone raz
+    all_cli_connections: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
     net_connect: Optional[ConnectHandler] = None
+    pool_enabled = bool(config.get('cli_pool_enabled', False))
+    pool_key = _ConnectionPool.key_for(device_params)
+    connected = False  # Czy sesja jest (wg naszej wiedzy) nadal używalna - zamiast sondowania is_alive() w finally
+    dirty = False  # Komenda zakończona wyjątkiem - w buforze mogą zostać nieprzeczytane dane, sesja nie wraca do puli
     effective_device_type = "N/A (przed połączeniem)"
     base_prompt_log = "N/A (przed odczytem)"
 
@@ -363,25 +1369,33 @@ def cli_get_neighbors_enhanced(host: str, username: str, password: str, config:
     default_expect_pattern_from_config = str(config.get('cli_default_expect_string_pattern', "")).strip()
     if not default_expect_pattern_from_config:
         logger.critical(
-            f"  CLI: KRYTYCZNY PROBLEM - 'cli_default_expect_string_pattern' z konfiguracji jest pusty ('{config.get('cli_default_expect_string_pattern')}'). Może to prowadzić do niekompletnych odpowiedzi z urządzeń. Proszę upewnić się, że jest poprawnie ustawiony w config.ini lub jego domyślna wartość w config_map jest prawidłowa. Używam awaryjnego wzorca: '{EMERGENCY_DEFAULT_EXPECT_PATTERN}'")
+            "  CLI: KRYTYCZNY PROBLEM - 'cli_default_expect_string_pattern' z konfiguracji jest pusty ('%s'). Może to prowadzić do niekompletnych odpowiedzi z urządzeń. Proszę upewnić się, że jest poprawnie ustawiony w config.ini lub jego domyślna wartość w config_map jest prawidłowa. Używam awaryjnego wzorca: '%s'", config.get('cli_default_expect_string_pattern'), EMERGENCY_DEFAULT_EXPECT_PATTERN)
         default_expect_pattern_from_config = EMERGENCY_DEFAULT_EXPECT_PATTERN  # Awaryjny fallback
         logger.warning(
-            f"  CLI: Używam AWARYJNEGO WZORCA expect_string: '{default_expect_pattern_from_config}' z powodu braku/pustej konfiguracji dla 'cli_default_expect_string_pattern'.")
-    logger.info(f"  CLI: Domyślny wzorzec expect_string (po ew. fallbacku): '{default_expect_pattern_from_config}'")
+            "  CLI: Używam AWARYJNEGO WZORCA expect_string: '%s' z powodu braku/pustej konfiguracji dla 'cli_default_expect_string_pattern'.", default_expect_pattern_from_config)
+    step_log("  CLI: Domyślny wzorzec expect_string (po ew. fallbacku): '%s'", default_expect_pattern_from_config)
 
     try:
-        logger.info(f"  CLI: Łączenie z {host} (autodetect, gdf={device_params['global_delay_factor']})...")
-        net_connect = ConnectHandler(**device_params)
+        step_log("  CLI: Łączenie z %s (autodetect, gdf=%s)...", host, device_params['global_delay_factor'])
+        if pool_enabled:
+            net_connect = _POOL.acquire(pool_key, device_params)
+        else:
+            net_connect = ConnectHandler(**device_params)
+        connected = True
         effective_device_type = net_connect.device_type
         try:
             if net_connect.base_prompt:
                 base_prompt_log = net_connect.base_prompt.strip()
         except Exception as e_bp:
-            logger.warning(f"  CLI: Wyjątek przy odczycie base_prompt dla {host}: {e_bp}")
+            logger.warning("  CLI: Wyjątek przy odczycie base_prompt dla %s: %s", host, e_bp)
             base_prompt_log = "N/A (błąd odczytu)"
 
-        logger.info(f"  CLI: Połączono z {host} (Typ Netmiko: '{effective_device_type}')")
-        logger.info(f"  CLI: Netmiko base_prompt: '{base_prompt_log}'")
+        trace["device_type"] = effective_device_type
+        step_log("  CLI: Połączono z %s (Typ Netmiko: '%s')", host, effective_device_type)
+        step_log("  CLI: Netmiko base_prompt: '%s'", base_prompt_log)
+        # Prompt wykryty przy połączeniu wystarcza dla kolejnych komend; ponowne wykrywanie tylko, gdy go nie znamy.
+        # Netmiko ignoruje auto_find_prompt, gdy podano expect_string - przy nieznanym prompcie expect_string pomijamy
+        auto_find_prompt = base_prompt_log in ("N/A (przed odczytem)", "N/A (błąd odczytu)")
 
         system_info_str = ""
         show_ver_expect_str: Optional[str] = None
@@ -395,178 +1409,445 @@ def cli_get_neighbors_enhanced(host: str, username: str, password: str, config:
 
         if is_base_prompt_valid_and_complex:
             show_ver_expect_str = base_prompt_log
-            logger.info(
-                f"  CLI: Używam złożonego base_prompt ('{base_prompt_log}') jako expect_string dla 'show version'.")
+            step_log(
+                "  CLI: Używam złożonego base_prompt ('%s') jako expect_string dla 'show version'.", base_prompt_log)
         else:
             show_ver_expect_str = default_expect_pattern_from_config
-            logger.info(
-                f"  CLI: Używam domyślnego wzorca expect_string ('{show_ver_expect_str}') dla 'show version' (base_prompt: '{base_prompt_log}', re_simple_prompt skompilowany: {bool(re_simple_prompt)}).")
+            step_log(
+                "  CLI: Używam domyślnego wzorca expect_string ('%s') dla 'show version' (base_prompt: '%s', re_simple_prompt skompilowany: %s).", show_ver_expect_str, base_prompt_log, bool(re_simple_prompt))
 
         try:
-            show_version_params: Dict[str, Any] = {"read_timeout": config.get('cli_read_timeout_general', 60)}
-            if show_ver_expect_str:  # Netmiko obsłuży None lub pusty string dla expect_string używając base_prompt lub swojego domyślnego
+            show_version_params: Dict[str, Any] = {"read_timeout": config.get('cli_read_timeout_general', 60),
+                                                   "auto_find_prompt": auto_find_prompt}
+            if show_ver_expect_str and not auto_find_prompt:  # Netmiko obsłuży None lub pusty string dla expect_string używając base_prompt lub swojego domyślnego
                 show_version_params["expect_string"] = show_ver_expect_str
 
-            logger.info(f"  CLI: Próba 'show version' na {host} z parametrami: {show_version_params}")
+            step_log("  CLI: Próba 'show version' na %s z parametrami: %s", host, show_version_params)
             show_version_output = net_connect.send_command("show version", **show_version_params)
 
             if show_version_output and isinstance(show_version_output, str):
                 system_info_str = show_version_output.lower()
-                logger.info(
-                    f"  CLI: Otrzymano 'show version' (długość: {len(show_version_output)}, fragment): {system_info_str[:250].replace(chr(10), ' ').replace(chr(13), '')}...")
+                if logger.isEnabledFor(step_level):
+                    step_log(
+                        "  CLI: Otrzymano 'show version' (długość: %s, fragment): %s...", len(show_version_output), system_info_str[:250].replace(chr(10), ' ').replace(chr(13), ''))
             else:
                 logger.warning(
-                    f"  CLI: Nie udało się uzyskać wyjścia 'show version' dla {host} (puste lub zły typ: {type(show_version_output)}). Wyjście (fragment): '{str(show_version_output)[:100]}'")
+                    "  CLI: Nie udało się uzyskać wyjścia 'show version' dla %s (puste lub zły typ: %s). Wyjście (fragment): '%s'", host, type(show_version_output), str(show_version_output)[:100])
         except Exception as e_ver:
+            dirty = True
             logger.warning(
-                f"  CLI: Błąd podczas 'show version' na {host} (użyty expect_string: '{show_ver_expect_str}'): {e_ver}",
-                exc_info=True)
+                "  CLI: Błąd podczas 'show version' na %s (użyty expect_string: '%s'): %s", host, show_ver_expect_str, e_ver,
+                exc_info=logger.isEnabledFor(logging.DEBUG))
+
+        # Przy device_type="autodetect" Netmiko (np. TerminalServerSSH) zostawia typ 'autodetect' - wtedy platformę
+        # (mapa protokołów, plan komend, cache możliwości) ustalamy z już pobranego 'show version'
+        if effective_device_type == "autodetect" and system_info_str:
+            effective_device_type = _device_type_from_version(system_info_str)
+            trace["device_type"] = effective_device_type
+            step_log("  CLI: Platforma %s ustalona z 'show version': '%s'", host, effective_device_type)
 
         # --- UPROSZCZONY expect_string dla LLDP/CDP ---
         # Zawsze używaj default_expect_pattern_from_config, chyba że base_prompt jest złożony.
         final_common_expect_str: Optional[str] = None
         if is_base_prompt_valid_and_complex:  # Ten warunek implikuje, że base_prompt_log jest prawidłowy, a re_simple_prompt był sprawdzony
             final_common_expect_str = base_prompt_log
-            logger.info(
-                f"  CLI (LLDP/CDP): Używam złożonego base_prompt ('{base_prompt_log}') jako wspólny expect_string.")
+            step_log(
+                "  CLI (LLDP/CDP): Używam złożonego base_prompt ('%s') jako wspólny expect_string.", base_prompt_log)
         else:
             final_common_expect_str = default_expect_pattern_from_config
-            logger.info(
-                f"  CLI (LLDP/CDP): Używam domyślnego wzorca ('{default_expect_pattern_from_config}') jako wspólny expect_string (base_prompt: '{base_prompt_log}', re_simple_prompt skompilowany: {bool(re_simple_prompt)}).")
+            step_log(
+                "  CLI (LLDP/CDP): Używam domyślnego wzorca ('%s') jako wspólny expect_string (base_prompt: '%s', re_simple_prompt skompilowany: %s).", default_expect_pattern_from_config, base_prompt_log, bool(re_simple_prompt))
 
         # Ostateczne sprawdzenie, aby upewnić się, że expect string nie jest pusty, jeśli ma być użyty.
         if final_common_expect_str and not final_common_expect_str.strip():
             logger.error(
-                f"  CLI: KRYTYCZNY PROBLEM - final_common_expect_str dla LLDP/CDP stał się pusty dla {host}. To wskazuje na problemy z default_expect_pattern_from_config lub base_prompt. Ustawiam na None, Netmiko użyje swoich wewnętrznych domyślnych.")
+                "  CLI: KRYTYCZNY PROBLEM - final_common_expect_str dla LLDP/CDP stał się pusty dla %s. To wskazuje na problemy z default_expect_pattern_from_config lub base_prompt. Ustawiam na None, Netmiko użyje swoich wewnętrznych domyślnych.", host)
             final_common_expect_str = None  # Pozwól Netmiko zdecydować, jeśli jest pusty
+        elif final_common_expect_str and not _is_valid_expect_pattern(final_common_expect_str):
+            logger.error(
+                "  CLI: expect_string '%s' dla %s nie jest poprawnym regexem. Ustawiam na None, Netmiko użyje swoich wewnętrznych domyślnych.", final_common_expect_str, host)
+            final_common_expect_str = None
 
-        logger.info(f"  CLI: Wspólny expect_string dla komend LLDP/CDP ustalony jako: '{final_common_expect_str}'")
+        step_log("  CLI: Wspólny expect_string dla komend LLDP/CDP ustalony jako: '%s'", final_common_expect_str)
         # --- Koniec UPROSZCZONEGO expect_string ---
 
-        lldp_cmd = "show lldp neighbors detail"
-        cdp_cmd = "show cdp neighbors detail"
-        run_cdp = True
-
-        # Dostosowanie komend specyficznych dla platformy
-        platform_for_log = "Unknown/Default"
-        if "extreme" in effective_device_type.lower() or "exos" in system_info_str or "enterasys" in system_info_str:
-            platform_for_log = "Extreme"
-            lldp_cmd = "show lldp neighbors detailed";
-            cdp_cmd = "show cdp neighbor detail"
-            try:
-                net_connect.send_command_timing("disable clipaging")
-            except Exception as e:
-                logger.warning(f"  CLI ({platform_for_log}): 'disable clipaging' nie powiodło się: {e}")
-        elif "junos" in effective_device_type.lower() or "juniper" in system_info_str:
-            platform_for_log = "Junos"
-            lldp_cmd = "show lldp neighbors interface all detail"
-            run_cdp = config.get("cli_junos_try_cdp", False)
+        plan = _plan_cli_commands(effective_device_type, _platform_markers(system_info_str), final_common_expect_str,
+                                  bool(config.get("cli_junos_try_cdp", False)))
+        lldp_cmd = plan.lldp_cmd
+        cdp_cmd = plan.cdp_cmd
+        force_protocol = config.get('cli_force_protocol')
+        protocols = _supported_protocols(effective_device_type, force_protocol)
+        run_lldp = "lldp" in protocols
+        if str(force_protocol or "").strip().lower() in ("cdp", "both"):
+            run_cdp = True
+        else:
+            run_cdp = plan.run_cdp and "cdp" in protocols
+        merge_lldp_cdp = bool(config.get('cli_merge_lldp_cdp', False))
+
+        # Protokoły, których urządzenie wcześniej nie obsłużyło, pomijamy (chyba że wymuszone w konfiguracji)
+        capabilities = _get_capabilities(host, effective_device_type, config)
+        forced_protocol = str(force_protocol or "").strip().lower()
+        if run_lldp and capabilities.get("lldp") is False and forced_protocol not in ("lldp", "both"):
+            run_lldp = False
+            step_log("  CLI: %s nie obsługiwał LLDP przy poprzednim odpytaniu (cache możliwości). Pomijam LLDP.", host)
+        if run_cdp and capabilities.get("cdp") is False and forced_protocol not in ("cdp", "both"):
+            run_cdp = False
+            step_log("  CLI: %s nie obsługiwał CDP przy poprzednim odpytaniu (cache możliwości). Pomijam CDP.", host)
+        if run_lldp and capabilities.get("lldp_cmd"):
+            lldp_cmd = capabilities["lldp_cmd"]
+
+        _disable_paging_once(net_connect, plan)
+
+        if logger.isEnabledFor(step_level):
+            step_log("  CLI (%s): Finalne ustawienia komend dla %s -> LLDP Cmd: '%s', CDP Cmd: '%s', "
+                     "Wspólny Expect: '%s', Uruchom LLDP: %s, Uruchom CDP: %s",
+                     plan.platform_for_log, host, lldp_cmd, cdp_cmd, plan.lldp_exp, run_lldp, run_cdp)
+
+        # Krótki read_timeout: expect_string kończy odczyt zaraz po promptcie, długi czas oczekiwania tylko dla wskazanych hostów
+        read_timeout_lldp_cdp = _lldp_cdp_read_timeout(host, config)
+
+        # Opcjonalnie: LLDP i CDP równolegle w osobnych kanałach exec tego samego połączenia SSH
+        batched_raw: Optional[List[str]] = None
+        if config.get('cli_parallel_channels', False) and run_lldp and run_cdp:
             try:
-                net_connect.send_command_timing("set cli screen-length 0", read_timeout=15)
-            except Exception as e:
-                logger.warning(f"  CLI ({platform_for_log}): 'set cli screen-length 0' nie powiodło się: {e}")
-        elif "ios" in effective_device_type.lower() or "catalyst" in system_info_str or "cisco_xe" in effective_device_type.lower() or "nx-os" in system_info_str or "cisco_nxos" in effective_device_type.lower():
-            platform_for_log = "Cisco-like (IOS/XE/NX-OS)"
-            if "nx-os" not in system_info_str and "cisco_nxos" not in effective_device_type.lower():  # NX-OS zazwyczaj nie potrzebuje 'terminal length 0'
-                try:
-                    net_connect.send_command_timing("terminal length 0", read_timeout=15)
-                except Exception as e:
-                    logger.warning(f"  CLI ({platform_for_log}): 'terminal length 0' nie powiodło się: {e}")
+                batched_raw = _exec_parallel_channels(net_connect, [lldp_cmd, cdp_cmd], read_timeout_lldp_cdp)
+                step_log("  CLI: Wykonano LLDP i CDP równolegle w kanałach exec dla %s.", host)
+            except Exception as e_parallel:
+                logger.warning(
+                    "  CLI: Równoległe kanały exec nie powiodły się dla %s: %s. Wykonuję komendy w sesji interaktywnej.", host, e_parallel)
+                batched_raw = None
 
-        logger.info(
-            f"  CLI ({platform_for_log}): Finalne ustawienia komend dla {host} -> LLDP Cmd: '{lldp_cmd}', CDP Cmd: '{cdp_cmd}', Wspólny Expect: '{final_common_expect_str}', Uruchom CDP: {run_cdp}")
+        # Opcjonalnie: LLDP i CDP jednym zapisem do kanału (jeden cykl oczekiwania na prompt zamiast dwóch)
+        if batched_raw is None and config.get('cli_batch_commands', False) and run_lldp and run_cdp and plan.lldp_exp:
+            try:
+                batched_raw = _send_commands_batched(net_connect, [lldp_cmd, cdp_cmd], plan.lldp_exp,
+                                                     read_timeout_lldp_cdp)
+                step_log("  CLI: Wysłano LLDP i CDP w jednej paczce dla %s.", host)
+            except Exception as e_batch:
+                dirty = True
+                logger.warning(
+                    "  CLI: Wysłanie LLDP/CDP w jednej paczce nie powiodło się dla %s: %s. Wykonuję komendy osobno.", host, e_batch)
+                batched_raw = None
 
         # Wykonanie LLDP
-        lldp_params: Dict[str, Any] = {"read_timeout": config.get('cli_read_timeout_lldp_cdp', 180)}
-        if final_common_expect_str: lldp_params["expect_string"] = final_common_expect_str
-        logger.info(f"  CLI: Wykonywanie LLDP dla {host} z parametrami: {lldp_params}")
-        try:
-            lldp_raw = net_connect.send_command(lldp_cmd, **lldp_params)
-            if lldp_raw and isinstance(lldp_raw, str) and lldp_raw.strip():
-                logger.info(f"  CLI-LLDP: Otrzymano surowe dane LLDP dla {host} (długość: {len(lldp_raw)}).")
-                conns_lldp = _parse_lldp_output(lldp_raw, host, config)
-                all_cli_connections.extend(conns_lldp)
-                if not conns_lldp:
-                    logger.info(f"  CLI-LLDP: Otrzymano dane LLDP, ale nie sparsowano z nich żadnych połączeń.")
-            elif lldp_raw is None or (isinstance(lldp_raw, str) and not lldp_raw.strip()):
-                logger.info(f"  CLI-LLDP: Brak danych LLDP (komenda zwróciła None lub pusty string) dla {host}.")
-            else:
-                logger.warning(
-                    f"  CLI-LLDP: Nieoczekiwany typ danych LLDP ({type(lldp_raw)}) dla {host}. Dane (fragment): '{str(lldp_raw)[:100]}'")
-        except Exception as e_lldp:
-            logger.warning(f"  CLI-LLDP: Błąd podczas komendy LLDP ('{lldp_cmd}') dla {host}: {e_lldp}", exc_info=False)
-            logger.debug(f"  CLI-LLDP: Pełny traceback błędu LLDP na {host}:", exc_info=True)
-
-            if ("nx-os" in system_info_str or "cisco_nxos" in effective_device_type.lower()) and \
-                    lldp_cmd == "show lldp neighbors detail" and \
-                    any(err_keyword in str(e_lldp).lower() for err_keyword in
-                        ["invalid", "incomplete", "unrecognized"]):
-                logger.info(f"  CLI-LLDP: Ponowna próba LLDP dla NX-OS {host} z komendą 'show lldp neighbors'")
-                lldp_cmd_nxos_fallback = "show lldp neighbors"
+        if run_lldp:
+            lldp_parser = _neighbor_parser("lldp", effective_device_type, config)
+            lldp_params: Dict[str, Any] = {"read_timeout": read_timeout_lldp_cdp,
+                                           "auto_find_prompt": auto_find_prompt}
+            if plan.lldp_exp and not auto_find_prompt: lldp_params["expect_string"] = plan.lldp_exp
+            step_log("  CLI: Wykonywanie LLDP dla %s z parametrami: %s", host, lldp_params)
+            lldp_fallback = False
+            try:
+                lldp_raw = (batched_raw[0] if batched_raw else net_connect.send_command(lldp_cmd, **lldp_params)) or ""
+                lldp_raw = _retry_if_paged(net_connect, plan, lldp_cmd, lldp_params, lldp_raw, lldp_log)
+                if lldp_raw.strip():
+                    lldp_step("Otrzymano surowe dane LLDP dla %s (długość: %s).", host, len(lldp_raw))
+                    lldp_error = _LLDP_ERROR_RE.search(lldp_raw, 0, _CLI_ERROR_HEAD_LEN)
+                    if lldp_error:
+                        lldp_step(
+                            "Urządzenie %s zwróciło błąd zamiast sąsiadów LLDP: '%s'. Pomijam parsowanie.", host, lldp_error.group(0).strip())
+                        # Netmiko nie zgłasza wyjątku dla '% Invalid input' - spróbuj komendy zapasowej platformy
+                        lldp_fallback = plan.lldp_fallback_cmd is not None and lldp_cmd != plan.lldp_fallback_cmd
+                        if not lldp_fallback:
+                            _record_capability(host, effective_device_type, config, lldp=False)
+                    else:
+                        _record_capability(host, effective_device_type, config, lldp=True)
+                        conns_lldp = _parse_cached(lldp_parser, lldp_raw, host, config)
+                        _add_connections(all_cli_connections, conns_lldp)
+                        trace["lldp_count"] += len(conns_lldp)
+                        if not conns_lldp:
+                            lldp_step("Otrzymano dane LLDP, ale nie sparsowano z nich żadnych połączeń.")
+                else:
+                    lldp_step("Brak danych LLDP (komenda zwróciła None lub pusty string) dla %s.", host)
+            except Exception as e_lldp:
+                dirty = True
+                trace["errors"].append(f"lldp: {e_lldp}")
+                lldp_log.warning("Błąd podczas komendy LLDP ('%s') dla %s: %s", lldp_cmd, host, e_lldp,
+                                 exc_info=logger.isEnabledFor(logging.DEBUG))
+                lldp_fallback = plan.lldp_fallback_cmd is not None and lldp_cmd != plan.lldp_fallback_cmd and \
+                    _CMD_REJECTED_RE.search(str(e_lldp)) is not None
+
+            if lldp_fallback:
+                lldp_cmd_fallback = plan.lldp_fallback_cmd
+                lldp_step("Ponowna próba LLDP dla %s z komendą '%s'", host, lldp_cmd_fallback)
                 try:
-                    lldp_raw_fallback = net_connect.send_command(lldp_cmd_nxos_fallback,
-                                                                 **lldp_params)  # Użyj tych samych parametrów
-                    if lldp_raw_fallback and isinstance(lldp_raw_fallback, str) and lldp_raw_fallback.strip():
-                        conns_fb = _parse_lldp_output(lldp_raw_fallback, host, config)
-                        all_cli_connections.extend(conns_fb)
-                        if not conns_fb: logger.info(
-                            f"  CLI-LLDP (fallback NXOS): Otrzymano dane, ale nie sparsowano połączeń.")
-                    elif not lldp_raw_fallback or (
-                            isinstance(lldp_raw_fallback, str) and not lldp_raw_fallback.strip()):
-                        logger.info(f"  CLI-LLDP (fallback NXOS): Brak danych (None lub pusty) dla {host}.")
+                    lldp_raw_fallback = net_connect.send_command(lldp_cmd_fallback,
+                                                                 **lldp_params) or ""  # Użyj tych samych parametrów
+                    if not lldp_raw_fallback.strip():
+                        nxos_fb_step("Brak danych (None lub pusty) dla %s.", host)
+                    elif _LLDP_ERROR_RE.search(lldp_raw_fallback, 0, _CLI_ERROR_HEAD_LEN):
+                        nxos_fb_step("Urządzenie %s odrzuciło również komendę zapasową.", host)
+                        _record_capability(host, effective_device_type, config, lldp=False)
+                    else:
+                        conns_fb = _parse_cached(_parse_lldp_output, lldp_raw_fallback, host, config)
+                        _add_connections(all_cli_connections, conns_fb)
+                        trace["lldp_count"] += len(conns_fb)
+                        if conns_fb:
+                            # Do cache możliwości trafia tylko komenda, która dała połączenia
+                            _record_capability(host, effective_device_type, config, lldp=True,
+                                               lldp_cmd=lldp_cmd_fallback)
+                        else:
+                            nxos_fb_step("Otrzymano dane, ale nie sparsowano połączeń.")
                 except Exception as e_nxos_fallback:
-                    logger.warning(
-                        f"  CLI-LLDP (fallback NXOS): Błąd komendy '{lldp_cmd_nxos_fallback}' dla {host}: {e_nxos_fallback}",
+                    dirty = True
+                    nxos_fb_log.warning(
+                        "Błąd komendy '%s' dla %s: %s", lldp_cmd_fallback, host, e_nxos_fallback,
                         exc_info=False)
-
-        # Wykonanie CDP (warunkowe)
-        if not all_cli_connections and run_cdp:
-            cdp_params: Dict[str, Any] = {"read_timeout": config.get('cli_read_timeout_lldp_cdp', 180)}
-            if final_common_expect_str: cdp_params["expect_string"] = final_common_expect_str
-            logger.info(f"  CLI: Wykonywanie CDP dla {host} z parametrami: {cdp_params}")
+        else:
+            step_log("  CLI: LLDP pominięte dla %s (platforma '%s' nie obsługuje LLDP lub wymuszono CDP).", host, effective_device_type)
+
+        # Wykonanie CDP (warunkowe; z cli_merge_lldp_cdp także po udanym LLDP - duplikaty scala _add_connections)
+        if run_cdp and (not all_cli_connections or merge_lldp_cdp):
+            cdp_params: Dict[str, Any] = {"read_timeout": read_timeout_lldp_cdp,
+                                          "auto_find_prompt": auto_find_prompt}
+            if plan.cdp_exp and not auto_find_prompt: cdp_params["expect_string"] = plan.cdp_exp
+            step_log("  CLI: Wykonywanie CDP dla %s z parametrami: %s", host, cdp_params)
             try:
-                cdp_raw = net_connect.send_command(cdp_cmd, **cdp_params)
-                if cdp_raw and isinstance(cdp_raw, str) and cdp_raw.strip():
-                    logger.info(f"  CLI-CDP: Otrzymano surowe dane CDP dla {host} (długość: {len(cdp_raw)}).")
-                    if "cdp not enabled" in cdp_raw.lower():
-                        logger.info(f"  CLI-CDP: CDP nie jest włączone na {host}.")
+                cdp_raw = (batched_raw[1] if batched_raw else net_connect.send_command(cdp_cmd, **cdp_params)) or ""
+                cdp_raw = _retry_if_paged(net_connect, plan, cdp_cmd, cdp_params, cdp_raw, cdp_log)
+                if cdp_raw.strip():
+                    cdp_step("Otrzymano surowe dane CDP dla %s (długość: %s).", host, len(cdp_raw))
+                    cdp_error = _CDP_ERROR_RE.search(cdp_raw, 0, _CLI_ERROR_HEAD_LEN)
+                    if _CDP_DISABLED_RE.search(cdp_raw, 0, _CDP_DISABLED_HEAD_LEN):
+                        cdp_step("CDP nie jest włączone na %s.", host)
+                        _record_capability(host, effective_device_type, config, cdp=False)
+                    elif cdp_error:
+                        cdp_step(
+                            "Urządzenie %s zwróciło błąd zamiast sąsiadów CDP: '%s'. Pomijam parsowanie.", host, cdp_error.group(0).strip())
+                        _record_capability(host, effective_device_type, config, cdp=False)
                     else:
-                        conns_cdp = _parse_cdp_output(cdp_raw, host, config)
-                        all_cli_connections.extend(conns_cdp)
+                        _record_capability(host, effective_device_type, config, cdp=True)
+                        conns_cdp = _parse_cached(_neighbor_parser("cdp", effective_device_type, config), cdp_raw, host, config)
+                        _add_connections(all_cli_connections, conns_cdp)
+                        trace["cdp_count"] += len(conns_cdp)
                         if not conns_cdp:
-                            logger.info(f"  CLI-CDP: Otrzymano dane CDP, ale nie sparsowano z nich żadnych połączeń.")
-                elif not cdp_raw or (isinstance(cdp_raw, str) and not cdp_raw.strip()):
-                    logger.info(f"  CLI-CDP: Brak danych CDP (None lub pusty) dla {host}.")
+                            cdp_step("Otrzymano dane CDP, ale nie sparsowano z nich żadnych połączeń.")
                 else:
-                    logger.warning(
-                        f"  CLI-CDP: Nieoczekiwany typ danych CDP ({type(cdp_raw)}) dla {host}. Dane (fragment): '{str(cdp_raw)[:100]}'")
+                    cdp_step("Brak danych CDP (None lub pusty) dla %s.", host)
             except Exception as e_cdp:
-                logger.warning(f"  CLI-CDP: Błąd podczas komendy CDP ('{cdp_cmd}') dla {host}: {e_cdp}", exc_info=False)
-                logger.debug(f"  CLI-CDP: Pełny traceback błędu CDP na {host}:", exc_info=True)
+                dirty = True
+                trace["errors"].append(f"cdp: {e_cdp}")
+                cdp_log.warning("Błąd podczas komendy CDP ('%s') dla %s: %s", cdp_cmd, host, e_cdp,
+                                exc_info=logger.isEnabledFor(logging.DEBUG))
         elif not run_cdp:
-            logger.info(f"  CLI: CDP pominięte dla {host} (run_cdp jest False).")
-        elif all_cli_connections and run_cdp:
-            logger.info(f"  CLI: LLDP dostarczyło wyników dla {host}. Pomijam CDP.")
+            step_log("  CLI: CDP pominięte dla %s (run_cdp jest False).", host)
+        else:
+            step_log("  CLI: LLDP dostarczyło wyników dla %s. Pomijam CDP.", host)
 
     except NetmikoAuthenticationException as e_auth_main:
-        logger.error(f"⚠ Błąd Uwierzytelnienia CLI dla {host}: {e_auth_main}")
+        trace["errors"].append(str(e_auth_main))
+        connected = False
+        logger.error("⚠ Błąd Uwierzytelnienia CLI dla %s: %s", host, e_auth_main)
     except NetmikoTimeoutException as e_timeout_main:
-        logger.error(f"⚠ Błąd Timeoutu CLI dla {host}: {e_timeout_main}")
+        trace["errors"].append(str(e_timeout_main))
+        connected = False
+        logger.error("⚠ Błąd Timeoutu CLI dla %s: %s", host, e_timeout_main)
+    except (OSError, EOFError, SSHException, NetmikoBaseException) as e_conn_main:
+        # Typowe błędy sieci/SSH (host nieosiągalny, zerwana sesja) - bez tracebacku, chyba że włączony DEBUG
+        trace["errors"].append(str(e_conn_main))
+        connected = False
+        logger.error("⚠ Błąd połączenia CLI z %s: %s", host, e_conn_main, exc_info=logger.isEnabledFor(logging.DEBUG))
     except Exception as e_general_main:
-        logger.error(f"⚠ Ogólny Błąd CLI z {host}: {e_general_main}", exc_info=True)
+        dirty = True
+        trace["errors"].append(str(e_general_main))
+        logger.error("⚠ Ogólny Błąd CLI z %s: %s", host, e_general_main, exc_info=True)
     finally:
-        if net_connect and net_connect.is_alive():
-            try:
-                net_connect.disconnect()
-                logger.info(f"  CLI: Rozłączono z {host}")
-            except Exception as e_disc_final:
-                logger.error(f"  CLI Błąd Rozłączenia dla {host}: {e_disc_final}", exc_info=True)
+        if net_connect and connected and pool_enabled and not dirty:
+            _POOL.release(pool_key, net_connect)
+            step_log("  CLI: Sesja z %s zwrócona do puli połączeń.", host)
+        elif net_connect and pool_enabled:
+            step_log("  CLI: Sesja Netmiko z %s nie była aktywna lub komenda zakończyła się błędem. Usuwam ją z puli.", host)
+            _POOL.discard(net_connect)
+        elif net_connect and connected:
+            _DISCONNECTOR.submit(net_connect)
+            step_log("  CLI: Rozłączanie z %s przekazane do wątku w tle.", host)
         elif net_connect:
-            logger.info(f"  CLI: Sesja Netmiko z {host} nie była aktywna przed próbą rozłączenia.")
+            step_log("  CLI: Sesja Netmiko z %s nie była aktywna przed próbą rozłączenia.", host)
+            _DISCONNECTOR.submit(net_connect)  # Tylko zwolnienie gniazda; sesja po błędzie nie wraca do puli
 
     if not all_cli_connections:
-        logger.info(f"⟶ CLI: Nie znaleziono sąsiadów CLI (LLDP/CDP) dla {host}.")
+        step_log("⟶ CLI: Nie znaleziono sąsiadów CLI (LLDP/CDP) dla %s.", host)
     else:
-        logger.info(f"✓ CLI: Znaleziono {len(all_cli_connections)} sąsiadów CLI dla {host} przez LLDP/CDP.")
-    return all_cli_connections
+        step_log("✓ CLI: Znaleziono %s sąsiadów CLI dla %s przez LLDP/CDP.", len(all_cli_connections), host)
+    if not verbose:
+        logger.info("  CLI: Podsumowanie odpytania %s: %s", host, trace)
+    return list(all_cli_connections.values())
+
+
+# --- Opcjonalny transport asyncssh (wiele sesji na jednym wątku) ---
+# Fragmenty 'show version' -> typ platformy w nazewnictwie Netmiko (dla _plan_cli_commands i map protokołów/szablonów)
+_VERSION_DEVICE_TYPES: Tuple[Tuple[str, str], ...] = (
+    ("nx-os", "cisco_nxos"),
+    ("ios-xe", "cisco_xe"),
+    ("ios xe", "cisco_xe"),
+    ("cisco ios", "cisco_ios"),
+    ("junos", "juniper_junos"),
+    ("arista", "arista_eos"),
+    ("extremexos", "extreme_exos"),
+)
+
+
+def _device_type_from_version(system_info_str: str) -> str:
+    for fragment, device_type in _VERSION_DEVICE_TYPES:
+        if fragment in system_info_str:
+            return device_type
+    return "unknown"
+
+
+def _async_output(result: Any) -> Optional[str]:
+    """stdout wyniku asyncssh albo None, gdy kod wyjścia jest różny od 0 lub brak go (kanał exec odrzucony), albo wyjście jest puste."""
+    raw_output = str(result.stdout or "")
+    if result.exit_status != 0 or not _NON_SPACE_RE.search(raw_output):
+        return None
+    return raw_output
 
+
+def _collect_async_output(protocol: str, result: Any, host: str, device_type: str, config: Dict[str, Any],
+                          connections: Dict[Tuple[Any, ...], Dict[str, Any]]) -> bool:
+    """
+    Parsuje wyjście LLDP/CDP z asyncssh i aktualizuje cache możliwości tak jak ścieżka Netmiko.
+    Zwraca False, jeśli komenda się nie powiodła (kod wyjścia, puste wyjście, komunikat błędu urządzenia) -
+    wtedy host powinien trafić do ścieżki Netmiko.
+    """
+    raw_output = _async_output(result)
+    if raw_output is None:
+        logger.warning("  CLI-async: %s na %s nie powiodło się (kod wyjścia: %s, stderr: '%s') lub zwróciło puste wyjście. "
+                       "Używam Netmiko.", protocol.upper(), host, result.exit_status, str(result.stderr or "").strip()[:100])
+        return False
+    if protocol == "lldp":
+        if _LLDP_ERROR_RE.search(raw_output, 0, _CLI_ERROR_HEAD_LEN):
+            _record_capability(host, device_type, config, lldp=False)
+            logger.warning("  CLI-async: %s odrzucił komendę LLDP. Używam Netmiko.", host)
+            return False
+        _record_capability(host, device_type, config, lldp=True)
+    else:
+        if _CDP_DISABLED_RE.search(raw_output, 0, _CDP_DISABLED_HEAD_LEN) or \
+                _CDP_ERROR_RE.search(raw_output, 0, _CLI_ERROR_HEAD_LEN):
+            _record_capability(host, device_type, config, cdp=False)
+            logger.warning("  CLI-async: %s odrzucił komendę CDP lub CDP jest wyłączone. Używam Netmiko.", host)
+            return False
+        _record_capability(host, device_type, config, cdp=True)
+    _add_connections(connections, _parse_cached(_neighbor_parser(protocol, device_type, config), raw_output, host, config))
+    return True
+
+
+def _async_known_hosts_kwargs(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Argument known_hosts dla asyncssh.connect wg cli_async_known_hosts: puste = domyślny ~/.ssh/known_hosts,
+    'none' = bez weryfikacji klucza hosta, inna wartość = ścieżka do pliku known_hosts.
+    """
+    known_hosts = str(config.get('cli_async_known_hosts') or "").strip()
+    if not known_hosts:
+        return {}
+    if known_hosts.lower() == "none":
+        return {"known_hosts": None}
+    return {"known_hosts": known_hosts}
+
+
+async def _probe_host_async(host: str, username: str, password: str, config: Dict[str, Any],
+                            semaphore: asyncio.Semaphore) -> Optional[List[Dict[str, Any]]]:
+    """
+    Odpytuje jeden host przez asyncssh (komendy w kanałach exec; LLDP i CDP równolegle tylko przy cli_merge_lldp_cdp).
+    Zwraca None, jeśli połączenie lub wykonanie komend się nie powiodło - wtedy host trafia do ścieżki Netmiko.
+    """
+    read_timeout = _lldp_cdp_read_timeout(host, config)
+    connections: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    forced_protocol = str(config.get('cli_force_protocol') or "").strip().lower()
+    merge_lldp_cdp = bool(config.get('cli_merge_lldp_cdp', False))
+    async with semaphore:
+        try:
+            async with asyncssh.connect(host, username=username, password=password,
+                                        connect_timeout=config.get('cli_conn_timeout', 75),
+                                        **_async_known_hosts_kwargs(config)) as conn:
+                version_output = _async_output(
+                    await conn.run("show version", check=False, timeout=config.get('cli_read_timeout_general', 60)))
+                if version_output is None:
+                    logger.warning("  CLI-async: 'show version' na %s nie powiodło się (kanał exec odrzucony lub puste wyjście). "
+                                   "Używam Netmiko.", host)
+                    return None
+                system_info_str = version_output.lower()
+                device_type = _device_type_from_version(system_info_str)
+                plan = _plan_cli_commands(device_type, _platform_markers(system_info_str), None,
+                                          bool(config.get("cli_junos_try_cdp", False)))
+                protocols = _supported_protocols(device_type, config.get('cli_force_protocol'))
+                # Jak w ścieżce Netmiko: protokoły nieobsłużone wcześniej pomijamy, zapamiętana komenda LLDP ma pierwszeństwo
+                capabilities = _get_capabilities(host, device_type, config)
+                run_lldp = "lldp" in protocols and (capabilities.get("lldp") is not False or
+                                                    forced_protocol in ("lldp", "both"))
+                run_cdp = "cdp" in protocols and (plan.run_cdp or forced_protocol in ("cdp", "both")) and \
+                    (capabilities.get("cdp") is not False or forced_protocol in ("cdp", "both"))
+                lldp_cmd = capabilities.get("lldp_cmd") or plan.lldp_cmd
+
+                # Każda nieudana komenda (kod wyjścia, puste wyjście, błąd urządzenia) oddaje host ścieżce Netmiko
+                if run_lldp and run_cdp and merge_lldp_cdp:
+                    lldp_result, cdp_result = await asyncio.gather(
+                        conn.run(lldp_cmd, check=False, timeout=read_timeout),
+                        conn.run(plan.cdp_cmd, check=False, timeout=read_timeout))
+                    if not (_collect_async_output("lldp", lldp_result, host, device_type, config, connections) and
+                            _collect_async_output("cdp", cdp_result, host, device_type, config, connections)):
+                        return None
+                else:
+                    if run_lldp:
+                        lldp_result = await conn.run(lldp_cmd, check=False, timeout=read_timeout)
+                        if not _collect_async_output("lldp", lldp_result, host, device_type, config, connections):
+                            return None
+                    # CDP tylko, gdy LLDP nic nie dało
+                    if run_cdp and not connections:
+                        cdp_result = await conn.run(plan.cdp_cmd, check=False, timeout=read_timeout)
+                        if not _collect_async_output("cdp", cdp_result, host, device_type, config, connections):
+                            return None
+        except (OSError, asyncio.TimeoutError, asyncssh.Error) as e:
+            logger.warning("  CLI-async: Odpytanie %s przez asyncssh nie powiodło się: %s. Używam Netmiko.", host, e)
+            return None
+
+    logger.info("✓ CLI-async: %s (%s) - %s sąsiadów.", host, device_type, len(connections))
+    return list(connections.values())
+
+
+async def _probe_hosts_async(hosts: List[Tuple[str, str, str]], config: Dict[str, Any]) -> List[Any]:
+    semaphore = asyncio.Semaphore(max(1, int(config.get('cli_async_max_sessions', 256))))
+    return await asyncio.gather(*(_probe_host_async(h[0], h[1], h[2], config, semaphore) for h in hosts),
+                                return_exceptions=True)
+
+
+def cli_get_neighbors_batch(hosts: List[Tuple[str, str, str]], config: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+    """
+    Odpytuje wiele hostów równolegle (ThreadPoolExecutor) - czas pracy to głównie oczekiwanie na SSH.
+    hosts: lista krotek (host, username, password). Zwraca listy sąsiadów w kolejności wejściowej.
+    """
+    if not hosts:
+        return []
+    if str(config.get('cli_transport', 'netmiko')).strip().lower() == "asyncssh":
+        if asyncssh is None:
+            logger.warning("  CLI: cli_transport = asyncssh, ale pakiet asyncssh nie jest zainstalowany. Używam Netmiko.")
+        else:
+            logger.info("⟶ CLI: Odpytywanie %s hostów przez asyncssh...", len(hosts))
+            async_results = asyncio.run(_probe_hosts_async(hosts, config))
+            fallback_idx = [i for i, res in enumerate(async_results) if not isinstance(res, list)]
+            for i in fallback_idx:
+                if isinstance(async_results[i], BaseException):
+                    logger.error("⚠ CLI-async: Nieoczekiwany błąd dla %s: %s", hosts[i][0], async_results[i])
+            if fallback_idx:
+                fallback_results = cli_get_neighbors_batch([hosts[i] for i in fallback_idx],
+                                                           {**config, 'cli_transport': 'netmiko'})
+                for i, res in zip(fallback_idx, fallback_results):
+                    async_results[i] = res
+            return async_results
+    max_workers = max(1, min(int(config.get('cli_max_workers', 32)), len(hosts)))
+    logger.info("⟶ CLI: Odpytywanie %s hostów (równolegle, wątki: %s)...", len(hosts), max_workers)
+    # Rozgrzej współdzielone cache (regexy, normalizator nazw) przed startem wątków
+    _lldp_regex_bundle(config)
+    _cdp_regex_bundle(config)
+    _build_normalizer(config.get('interface_name_replacements', {}))
+    results: List[List[Dict[str, Any]]] = [[] for _ in hosts]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cli-probe") as executor:
+        future_to_idx = {executor.submit(cli_get_neighbors_enhanced, host, username, password, config): idx
+                         for idx, (host, username, password) in enumerate(hosts)}
+        for future in concurrent.futures.as_completed(future_to_idx):
+            idx = future_to_idx[future]
+            try:
+                results[idx] = future.result()
+            except Exception as e:
+                # Błąd jednego hosta nie może przerwać zbierania wyników pozostałych
+                logger.error("⚠ CLI: Nieoczekiwany błąd wątku dla %s: %s", hosts[idx][0], e, exc_info=True)
+    return results
@@ -1,7 +1,8 @@
 # common_device_logic.py
 import logging
 import re
-import math
+import functools
+import concurrent.futures
 from typing import List, Dict, Tuple, Optional, Any, NamedTuple, Pattern, Set
 
 from librenms_client import LibreNMSAPI
@@ -11,12 +12,15 @@ logger = logging.getLogger(__name__)
 
 try:
     import natsort
-    natsort_keygen = natsort.natsort_keygen()
+    _NATKEY = natsort.natsort_keygen()  # Funkcja klucza budowana raz; wywoływana na nazwie portu
     logger.debug("Moduł 'natsort' zaimportowany pomyślnie dla common_device_logic.")
 except ImportError:
     logger.warning("Moduł 'natsort' nie znaleziony. Sortowanie nazw portów będzie standardowe.")
-    def natsort_keygen(): # type: ignore
-        return lambda x: str(x)
+    _NATKEY = str
+
+
+# Kolumny portów z API LibreNMS potrzebne do klasyfikacji i layoutu chassis
+_DISPLAY_PORT_COLUMNS = "port_id,ifIndex,ifName,ifDescr,ifType,ifPhysAddress,ifOperStatus,ifAdminStatus,ifAlias"
 
 
 class PortEndpointData(NamedTuple):
@@ -46,15 +50,39 @@ class DeviceDisplayData(NamedTuple):
     ports_display_limited: bool
 
 
+@functools.lru_cache(maxsize=64)
+def _cached_compile(pattern_str: str, flags: int) -> Pattern[str]:
+    """re.compile z cache - wzorce z config kompilowane są raz, a nie przy każdym wywołaniu classify_ports."""
+    return re.compile(pattern_str, flags)
+
+
 def _compile_regex_from_config(config: Dict[str, Any], key: str, default_pattern: str = ".*", flags: int = 0) -> Pattern[str]:
     pattern_str = config.get(key) # config_loader zapewni wartość domyślną, jeśli klucza nie ma w .ini
     try:
         if pattern_str and pattern_str.strip():
-            return re.compile(pattern_str, flags)
+            return _cached_compile(pattern_str, flags)
     except re.error as e:
         logger.error(f"Błąd kompilacji regex z config dla klucza '{key}' (wzorzec: '{pattern_str}'): {e}. Używam domyślnego '{default_pattern}'.")
     # Jeśli pattern_str jest None (bo klucza nie było i default z config_loader to None) lub pusty, lub błąd kompilacji
-    return re.compile(default_pattern, flags)
+    return _cached_compile(default_pattern, flags)
+
+
+_MGMT0_NAMES = frozenset({'mgmt0', 'management0'})
+_LAG_NAME_KEYWORDS = ('port-ch', 'bundle-eth', 'lag', 'bond', 'ae')
+
+
+def _is_mgmt0_name(name_lower: str) -> bool:
+    return name_lower in _MGMT0_NAMES or (name_lower.startswith("mgmt") and name_lower.endswith("0"))
+
+
+def _port_sort_key(port_info: Dict[str, Any]) -> Any:
+    return _NATKEY(port_info.get('ifName', str(port_info.get('port_id', 'zzzz'))))
+
+
+def _port_key(port_info: Dict[str, Any]) -> Any:
+    # port_id z LibreNMS jest unikalny; bez niego porównujemy tożsamość obiektu
+    port_id = port_info.get('port_id')
+    return ('port_id', port_id) if port_id is not None else ('obj', id(port_info))
 
 
 def classify_ports(
@@ -68,6 +96,9 @@ def classify_ports(
     physical_ports: List[Dict[str, Any]] = []
     logical_interfaces: List[Dict[str, Any]] = []
     mgmt0_port_info: Optional[Dict[str, Any]] = None
+    # Klucze portów już dodanych do list - zamiast liniowego 'port_info not in lista' (porównania całych słowników)
+    physical_keys: Set[Any] = set()
+    logical_keys: Set[Any] = set()
 
     # Pobieranie regexów i zbiorów z konfiguracji
     # _compile_regex_from_config użyje swojego default_pattern jeśli klucz z config da None lub pusty string
@@ -83,42 +114,27 @@ def classify_ports(
     logger.debug(f"ClassifyPorts ({device_hostname_for_log}): Używane zbiory IANA: Phys (len:{len(physical_types_iana)}), Logical (len:{len(logical_types_iana)})")
 
 
-    temp_mgmt0_candidates = []
-    other_ports_to_classify = []
-
-    for port in ports_data_from_api:
-        if_name_lower = str(port.get('ifName', '')).lower()
-        if_descr_lower = str(port.get('ifDescr', '')).lower()
-
-        if 'mgmt0' == if_name_lower or 'management0' == if_name_lower or \
-           'mgmt0' == if_descr_lower or 'management0' == if_descr_lower or \
-           (if_name_lower.startswith("mgmt") and if_name_lower.endswith("0")) or \
-           (if_descr_lower.startswith("mgmt") and if_descr_lower.endswith("0")):
-            temp_mgmt0_candidates.append(port)
-        else:
-            other_ports_to_classify.append(port)
+    # Kandydaci mgmt0 nie są klasyfikowani w pętli - po niej wybierany jest pierwszy z MAC (lub pierwszy w ogóle)
+    first_mgmt0: Optional[Dict[str, Any]] = None
+    first_mgmt0_with_mac: Optional[Dict[str, Any]] = None
 
-    if temp_mgmt0_candidates:
-        mgmt0_with_mac = [p for p in temp_mgmt0_candidates if p.get('ifPhysAddress')];
-        if mgmt0_with_mac:
-            mgmt0_port_info = mgmt0_with_mac[0]
-        else:
-            mgmt0_port_info = temp_mgmt0_candidates[0]
-
-        logger.debug(
-            f"Port mgmt0 zidentyfikowany dla {device_hostname_for_log}: {mgmt0_port_info.get('ifName')} (ID: {mgmt0_port_info.get('port_id')})")
-        if mgmt0_port_info not in physical_ports:
-             physical_ports.append(mgmt0_port_info)
+    for port_info in ports_data_from_api:
+        if_name_lower = str(port_info.get('ifName', '')).lower()
+        if_descr_lower = str(port_info.get('ifDescr', '')).lower()
 
+        if _is_mgmt0_name(if_name_lower) or _is_mgmt0_name(if_descr_lower):
+            if first_mgmt0 is None:
+                first_mgmt0 = port_info
+            if first_mgmt0_with_mac is None and port_info.get('ifPhysAddress'):
+                first_mgmt0_with_mac = port_info
+            continue
 
-    for port_info in other_ports_to_classify:
         if_name, if_descr = str(port_info.get('ifName', '')), str(port_info.get('ifDescr', ''))
         if_type_raw = port_info.get('ifType')
         if_phys_address = str(port_info.get('ifPhysAddress', ''))
         if_oper_status = str(port_info.get('ifOperStatus', '')).lower()
 
-        if port_info != mgmt0_port_info and \
-           (if_oper_status == "notpresent" or (if_oper_status == "lowerlayerdown" and not if_phys_address)):
+        if if_oper_status == "notpresent" or (if_oper_status == "lowerlayerdown" and not if_phys_address):
             logger.debug(
                 f"Pomijanie portu '{if_name}' ({if_descr}) na {device_hostname_for_log} (status: '{if_oper_status}', brak MAC).")
             continue
@@ -149,23 +165,29 @@ def classify_ports(
             is_physical = False
 
         if if_type_iana == 'ieee8023adlag' or \
-           any(k in if_name.lower() for k in ['port-ch', 'bundle-eth', 'lag', 'bond', 'ae']) or \
-           any(k in if_descr.lower() for k in ['port-ch', 'bundle-eth', 'lag', 'bond', 'ae']):
+           any(k in if_name_lower for k in _LAG_NAME_KEYWORDS) or \
+           any(k in if_descr_lower for k in _LAG_NAME_KEYWORDS):
             is_physical = has_mac
             if not has_mac:
                  logger.debug(f"Port LAG '{if_name}' ({if_descr}) na {device_hostname_for_log} bez MAC traktowany jako logiczny.")
 
-        if port_info == mgmt0_port_info and mgmt0_port_info in physical_ports:
-            continue
-
+        port_key = _port_key(port_info)
         if is_physical:
-            if port_info not in physical_ports:
+            if port_key not in physical_keys:
+                physical_keys.add(port_key)
                 physical_ports.append(port_info)
         else:
             port_info['_ifType_iana_debug'] = if_type_iana
-            if port_info not in logical_interfaces:
+            if port_key not in logical_keys:
+                logical_keys.add(port_key)
                 logical_interfaces.append(port_info)
 
+    mgmt0_port_info = first_mgmt0_with_mac if first_mgmt0_with_mac is not None else first_mgmt0
+    if mgmt0_port_info is not None:
+        logger.debug(
+            f"Port mgmt0 zidentyfikowany dla {device_hostname_for_log}: {mgmt0_port_info.get('ifName')} (ID: {mgmt0_port_info.get('port_id')})")
+        physical_ports.insert(0, mgmt0_port_info)
+
     logger.info(
         f"Klasyfikacja portów dla '{device_hostname_for_log}': {len(physical_ports)} fizycznych (w tym mgmt0, jeśli znaleziono), {len(logical_interfaces)} logicznych/innych.")
     return physical_ports, logical_interfaces, mgmt0_port_info
@@ -202,25 +224,10 @@ def calculate_device_chassis_layout(
         if num_ports_actually_displaying > max_physical_ports_display_cfg / 1.5 \
         else ports_per_row_normal_cfg
 
-    num_rows = max(1, math.ceil(num_ports_actually_displaying / ports_per_row_config))
-
-    actual_ports_in_widest_row = 0
-    if num_rows > 0:
-        ports_left = num_ports_actually_displaying
-        max_in_row_calc = 0
-        for _ in range(num_rows):
-            current_row_count = min(ports_left, ports_per_row_config)
-            if current_row_count > max_in_row_calc:
-                max_in_row_calc = current_row_count
-            ports_left -= current_row_count
-            if ports_left <= 0:
-                break
-        if num_rows == 1:
-            actual_ports_in_widest_row = num_ports_actually_displaying
-        else:
-            actual_ports_in_widest_row = min(num_ports_actually_displaying, ports_per_row_config)
-    else:
-        actual_ports_in_widest_row = 0
+    num_rows = max(1, -(-num_ports_actually_displaying // ports_per_row_config))  # Dzielenie całkowite z zaokrągleniem w górę
+
+    # Przy jednym rzędzie są w nim wszystkie porty; przy kilku pierwszy rząd jest pełny
+    actual_ports_in_widest_row = min(num_ports_actually_displaying, ports_per_row_config)
 
     chassis_content_width = actual_ports_in_widest_row * port_width_cfg + \
                             max(0, actual_ports_in_widest_row - 1) * horizontal_spacing_cfg
@@ -238,28 +245,36 @@ def calculate_device_chassis_layout(
     return DynamicLayoutInfo(chassis_width, chassis_height, num_rows, ports_per_row_config)
 
 
+def _fetch_device_ports(dev_api_info: Dict[str, Any], api: LibreNMSAPI, canon_id: str) -> List[Dict[str, Any]]:
+    if not dev_api_info.get("device_id"):
+        return []
+    try:
+        return api.get_ports(str(dev_api_info["device_id"]), columns=_DISPLAY_PORT_COLUMNS) or []
+    except Exception as e:
+        logger.error(f"Błąd pobierania portów dla {canon_id} (ID: {dev_api_info.get('device_id')}): {e}", exc_info=True)
+        return []
+
+
 def prepare_device_display_data(
         dev_api_info: Dict[str, Any],
         api: LibreNMSAPI,
         dev_idx: int,
-        config: Dict[str, Any]
+        config: Dict[str, Any],
+        ports_data: Optional[List[Dict[str, Any]]] = None
     ) -> DeviceDisplayData:
 
     canon_id = get_canonical_identifier(dev_api_info) or f"Urządzenie_idx_{dev_idx}"
     logger.debug(f"Przygotowywanie danych wyświetlania dla: {canon_id} (ID API: {dev_api_info.get('device_id')})")
 
-    ports_data = []
-    if dev_api_info.get("device_id"):
-        try:
-            ports_data = api.get_ports(
-                str(dev_api_info["device_id"]),
-                columns="port_id,ifIndex,ifName,ifDescr,ifType,ifPhysAddress,ifOperStatus,ifAdminStatus,ifAlias"
-            ) or []
-        except Exception as e:
-            logger.error(f"Błąd pobierania portów dla {canon_id} (ID: {dev_api_info.get('device_id')}): {e}", exc_info=True)
+    if ports_data is None:  # Porty nie zostały pobrane wcześniej (np. przez prepare_device_display_data_batch)
+        ports_data = _fetch_device_ports(dev_api_info, api, canon_id)
 
     all_phys_classified, logical_ifs_classified, mgmt0_info = classify_ports(ports_data, canon_id, config)
 
+    # Pełne listy sortowane raz; kandydaci do layoutu są ich podzbiorem wybieranym w tej samej kolejności
+    all_phys_classified.sort(key=_port_sort_key)
+    logical_ifs_classified.sort(key=_port_sort_key)
+
     phys_candidates_for_layout = []
     for p in all_phys_classified:
         if p == mgmt0_info:
@@ -273,12 +288,6 @@ def prepare_device_display_data(
             continue
         phys_candidates_for_layout.append(p)
 
-    try:
-        phys_candidates_for_layout.sort(key=lambda p: natsort_keygen(p.get('ifName', str(p.get('port_id', 'zzzz')))))
-    except Exception:
-        logger.warning(f"Błąd natsort dla portów fizycznych (layout) '{canon_id}'. Używam standardowego sortowania.")
-        phys_candidates_for_layout.sort(key=lambda p: str(p.get('ifName', str(p.get('port_id', 'zzzz')))))
-
 
     total_phys_before_limit = len(phys_candidates_for_layout)
     limited_flag = False
@@ -295,14 +304,6 @@ def prepare_device_display_data(
     else:
         phys_for_layout = phys_candidates_for_layout
 
-    try:
-        all_phys_classified.sort(key=lambda p: natsort_keygen(p.get('ifName', str(p.get('port_id', 'zzzz')))))
-        logical_ifs_classified.sort(key=lambda p: natsort_keygen(p.get('ifName', str(p.get('port_id', 'zzzz')))))
-    except Exception:
-        logger.warning(f"Błąd natsort dla pełnych list portów '{canon_id}'. Używam standardowego sortowania.")
-        all_phys_classified.sort(key=lambda p: str(p.get('ifName', str(p.get('port_id', 'zzzz')))))
-        logical_ifs_classified.sort(key=lambda p: str(p.get('ifName', str(p.get('port_id', 'zzzz')))))
-
 
     layout_info = calculate_device_chassis_layout(total_phys_before_limit, len(phys_for_layout), config)
 
@@ -330,5 +331,32 @@ def prepare_device_display_data(
     )
 
 
+def prepare_device_display_data_batch(
+        dev_api_infos: List[Dict[str, Any]],
+        api: LibreNMSAPI,
+        config: Dict[str, Any]
+    ) -> List[Optional[DeviceDisplayData]]:
+    """
+    Jak prepare_device_display_data dla listy urządzeń, ale porty z API pobierane są równolegle (api_max_workers).
+    Zwraca wyniki w kolejności wejścia; None dla urządzeń, których nie udało się przygotować.
+    """
+    if not dev_api_infos:
+        return []
+    max_workers = max(1, min(int(config.get('api_max_workers', 16)), len(dev_api_infos)))
+    canon_ids = [get_canonical_identifier(dev) or f"Urządzenie_idx_{idx}" for idx, dev in enumerate(dev_api_infos)]
+    logger.info(f"Pobieranie portów dla {len(dev_api_infos)} urządzeń (równolegle, wątki: {max_workers})...")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        ports_per_device = list(executor.map(_fetch_device_ports, dev_api_infos, [api] * len(dev_api_infos), canon_ids))
+
+    results: List[Optional[DeviceDisplayData]] = []
+    for idx, (dev_api_info, ports_data) in enumerate(zip(dev_api_infos, ports_per_device)):
+        try:
+            results.append(prepare_device_display_data(dev_api_info, api, idx, config, ports_data=ports_data))
+        except Exception as e_prepare:
+            logger.error(f"Błąd podczas przygotowywania danych dla urządzenia {canon_ids[idx]}: {e_prepare}", exc_info=True)
+            results.append(None)
+    return results
+
+
 def get_device_render_size_from_prepared_data(prep_data: DeviceDisplayData) -> Tuple[float, float]:
     return prep_data.chassis_layout.width, prep_data.chassis_layout.height
\ No newline at end of file
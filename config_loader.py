@@ -61,7 +61,7 @@ def _get_typed_value(config_parser: configparser.ConfigParser, section: str, opt
                     (value_str.startswith("'") and value_str.endswith("'")):
                 value_str = value_str[1:-1]
             val = [item.strip() for item in value_str.split(',') if item.strip()]
-        elif expected_type == dict and option == "interface_name_replacements":
+        elif expected_type == dict and option in ("interface_name_replacements", "cli_read_timeout_overrides"):
             value_str_raw = config_parser.get(section, option)
             value_str = value_str_raw.strip()
             if (value_str.startswith('"') and value_str.endswith('"')) or \
@@ -205,6 +205,7 @@ def load_config(config_path: str = DEFAULT_CONFIG_FILE) -> Dict[str, Any]:
         "diagram_output_svg_file": ("DEFAULT", "diagram_output_svg_file", str, "network_diagram.svg"),
         "api_timeout": ("LibreNMS", "api_timeout", int, 20),
         "verify_ssl": ("LibreNMS", "verify_ssl", bool, False),
+        "api_max_workers": ("LibreNMS", "api_max_workers", int, 16),
         "default_snmp_communities": ("Discovery", "default_snmp_communities", list, ["public"]),
         "snmp_timeout": ("Discovery", "snmp_timeout", int, 5),
         "snmp_retries": ("Discovery", "snmp_retries", int, 1),
@@ -216,10 +217,26 @@ def load_config(config_path: str = DEFAULT_CONFIG_FILE) -> Dict[str, Any]:
         "cli_auth_timeout": ("CLI", "auth_timeout", int, 90),
         "cli_banner_timeout": ("CLI", "banner_timeout", int, 75),
         "cli_read_timeout_general": ("CLI", "read_timeout_general", int, 60),
-        "cli_read_timeout_lldp_cdp": ("CLI", "read_timeout_lldp_cdp", int, 180),
+        "cli_read_timeout_lldp_cdp": ("CLI", "read_timeout_lldp_cdp", int, 20),
         "cli_default_expect_string_pattern": ("CLI", "default_expect_string_pattern", str, r"[a-zA-Z0-9\S\.\-]*[#>]"),
         "cli_netmiko_session_log_template": ("CLI", "netmiko_session_log_template", str, "{host}_netmiko_session.log"),
+        "cli_netmiko_session_log_enabled": ("CLI", "netmiko_session_log_enabled", bool, True),
         "cli_junos_try_cdp": ("CLI", "cli_junos_try_cdp", bool, False),
+        "cli_pool_enabled": ("CLI", "cli_pool_enabled", bool, False),
+        "cli_batch_commands": ("CLI", "cli_batch_commands", bool, False),
+        "cli_max_workers": ("CLI", "cli_max_workers", int, 32),
+        "cli_fast_mode": ("CLI", "cli_fast_mode", bool, False),
+        "cli_fast_global_delay_factor": ("CLI", "cli_fast_global_delay_factor", float, 0.1),
+        "cli_force_protocol": ("CLI", "cli_force_protocol", str, ""),
+        "cli_parallel_channels": ("CLI", "cli_parallel_channels", bool, False),
+        "cli_verbose_log": ("CLI", "cli_verbose_log", bool, True),
+        "cli_cache_dir": ("CLI", "cli_cache_dir", str, ""),
+        "cli_parser_engine": ("CLI", "cli_parser_engine", str, "regex"),
+        "cli_transport": ("CLI", "cli_transport", str, "netmiko"),
+        "cli_async_max_sessions": ("CLI", "cli_async_max_sessions", int, 256),
+        "cli_async_known_hosts": ("CLI", "cli_async_known_hosts", str, ""),
+        "cli_read_timeout_overrides": ("CLI", "cli_read_timeout_overrides", dict, {}),
+        "cli_merge_lldp_cdp": ("CLI", "cli_merge_lldp_cdp", bool, False),
         "prompt_regex_slot_sys": ("CLI", "prompt_regex_slot_sys", str, r'(?:\*\s*)?Slot-\d+\s+[\w.-]+\s*#\s*$'),
         "prompt_regex_simple": ("CLI", "prompt_regex_simple", str, r"^[a-zA-Z0-9][\w.-]*[>#]\s*$"),
         "prompt_regex_nxos": ("CLI", "prompt_regex_nxos", str, r"^[a-zA-Z0-9][\w.-]*#\s*$"),
@@ -140,7 +140,7 @@ class DiagramGenerator:
         logger.info("Krok 3a: Identyfikacja urządzeń docelowych i przygotowywanie danych...")
         target_set = set(str(ip_or_host).lower().strip() for ip_or_host in target_ips_or_hosts)
         self.target_devices_prepared_data = []
-        device_render_idx_counter = 0
+        target_device_entries: List[Dict[str, Any]] = []
         for device_api_info_entry in self.all_devices_from_api:
             current_canonical_id = get_canonical_identifier(
                 device_api_info_entry)
@@ -162,16 +162,13 @@ class DiagramGenerator:
                     break
 
             if is_target_device:
-                try:
-                    prepared_data = common_device_logic.prepare_device_display_data(
-                        device_api_info_entry, self.api_client, device_render_idx_counter, self.config
-                    )
-                    self.target_devices_prepared_data.append(prepared_data)
-                    device_render_idx_counter += 1
-                except Exception as e_prepare:
-                    logger.error(
-                        f"Błąd podczas przygotowywania danych dla urządzenia {current_canonical_id or device_api_info_entry.get('hostname')}: {e_prepare}",
-                        exc_info=True)
+                target_device_entries.append(device_api_info_entry)
+
+        # Porty urządzeń docelowych pobierane są z API równolegle; błędy przygotowania są logowane w batchu
+        for prepared_data in common_device_logic.prepare_device_display_data_batch(
+                target_device_entries, self.api_client, self.config):
+            if prepared_data is not None:
+                self.target_devices_prepared_data.append(prepared_data)
 
         if not self.target_devices_prepared_data:
             logger.warning("Brak urządzeń docelowych po filtrowaniu i przygotowaniu danych.")
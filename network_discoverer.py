@@ -181,6 +181,7 @@ class NetworkDiscoverer:
     def _process_all_target_devices(self, target_ips_or_hosts: List[str]) -> List[Dict[str, Any]]:
         all_connections_raw: List[Dict[str, Any]] = []
         total_targets = len(target_ips_or_hosts)
+        resolved_targets: List[Tuple[str, Dict[str, Any]]] = []
         for i, ip_or_host_target in enumerate(target_ips_or_hosts):
             logger.info(
                 f"\n--- Przetwarzanie urządzenia docelowego ({i + 1}/{total_targets}): '{ip_or_host_target}' ---")
@@ -194,10 +195,17 @@ class NetworkDiscoverer:
             if not canonical_id:
                 logger.warning(f"Nie można ustalić kanonicznego ID dla '{ip_or_host_target}'. Pomijam.")
                 continue
+            resolved_targets.append((canonical_id, target_device_api_info))
+
+        # CLI (SSH) jest zdominowane przez I/O - odpytaj wszystkie hosty równolegle przed przetwarzaniem sekwencyjnym
+        cli_neighbors_per_target = self._discover_cli_neighbors([info for _, info in resolved_targets])
+
+        for (canonical_id, target_device_api_info), cli_neighbors in zip(resolved_targets, cli_neighbors_per_target):
             logger.info(
                 f"Rozpoczynam odkrywanie dla: {canonical_id} (ID API: {target_device_api_info.get('device_id')})")
 
             device_connections = self._process_single_target_device(target_device_api_info)
+            device_connections.extend(cli_neighbors)
             if device_connections:
                 logger.info(
                     f"✓ Znaleziono {len(device_connections)} potencjalnych surowych połączeń dla {canonical_id}.")
@@ -206,6 +214,33 @@ class NetworkDiscoverer:
                 logger.info(f"  Nie wykryto żadnych surowych połączeń dla {canonical_id}.")
         return all_connections_raw
 
+    def _discover_cli_neighbors(self, target_devices_info: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Zwraca listę sąsiadów CLI dla każdego urządzenia (w kolejności wejścia); hosty odpytywane są równolegle."""
+        cli_targets = [self._get_cli_target(info) for info in target_devices_info]
+        hosts_to_probe = [target for target in cli_targets if target]
+        results_iter = iter(cli_utils.cli_get_neighbors_batch(hosts_to_probe, self.config))
+        return [next(results_iter) if target else [] for target in cli_targets]
+
+    def _get_cli_target(self, target_device_info: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
+        canonical_id = get_canonical_identifier(target_device_info) or \
+                       f"Nieznane_urządzenie_ID_{target_device_info.get('device_id')}"
+        enable_cli = self.config.get('enable_cli_discovery', True)
+        if not enable_cli:
+            logger.info(
+                f"  Odkrywanie przez CLI jest wyłączone w konfiguracji (enable_cli_discovery=False). Pomijam dla {canonical_id}.")
+            return None
+        cli_creds_tuple = self._get_cli_credentials_for_device(target_device_info)
+        if not cli_creds_tuple:
+            logger.info(f"  Pominięto CLI dla {canonical_id} - brak skonfigurowanych/dopasowanych poświadczeń.")
+            return None
+        host_for_cli = target_device_info.get('hostname') or target_device_info.get('ip')
+        if not host_for_cli:
+            logger.warning(f"  Pominięto CLI dla {canonical_id} - brak adresu IP/hostname do połączenia.")
+            return None
+        cli_user, cli_pass = cli_creds_tuple
+        logger.info(f"  Próba metody CLI dla {canonical_id} (adres: {host_for_cli})...")
+        return host_for_cli, cli_user, cli_pass
+
     def _process_single_target_device(self, target_device_info: Dict[str, Any]) -> List[Dict[str, Any]]:
         device_id_api = str(target_device_info['device_id'])
         canonical_id = get_canonical_identifier(target_device_info) or f"Nieznane_urządzenie_ID_{device_id_api}"
@@ -239,24 +274,6 @@ class NetworkDiscoverer:
         device_raw_connections.extend(
             discovery.find_via_api_fdb(self.api_client, self.phys_mac_map, target_device_info))
 
-        enable_cli = self.config.get('enable_cli_discovery', True)
-        if enable_cli:
-            cli_creds_tuple = self._get_cli_credentials_for_device(target_device_info)
-            if cli_creds_tuple:
-                cli_user, cli_pass = cli_creds_tuple
-                host_for_cli = target_device_info.get('hostname') or target_device_info.get('ip')
-                if host_for_cli:
-                    logger.info(f"  Próba metody CLI dla {canonical_id} (adres: {host_for_cli})...");
-                    cli_neighbors = cli_utils.cli_get_neighbors_enhanced(host_for_cli, cli_user, cli_pass, self.config)
-                    device_raw_connections.extend(cli_neighbors)
-                else:
-                    logger.warning(f"  Pominięto CLI dla {canonical_id} - brak adresu IP/hostname do połączenia.")
-            else:
-                logger.info(f"  Pominięto CLI dla {canonical_id} - brak skonfigurowanych/dopasowanych poświadczeń.")
-        else:
-            logger.info(
-                f"  Odkrywanie przez CLI jest wyłączone w konfiguracji (enable_cli_discovery=False). Pomijam dla {canonical_id}.")
-
         return device_raw_connections
 
     def _build_port_name_to_ifindex_map(self) -> None:
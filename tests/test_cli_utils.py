@@ -0,0 +1,172 @@
+import re
+import shelve
+
+import cli_utils
+import config_loader
+
+
+class FakeBatchConnection:
+    """Symuluje kanał Netmiko: write_channel zapisuje komendy, read_until_pattern czyta bufor do wzorca."""
+
+    def __init__(self, base_prompt, responses):
+        self.base_prompt = base_prompt
+        self.responses = responses
+        self.buffer = ""
+
+    def normalize_cmd(self, cmd):
+        return cmd.rstrip() + "\n"
+
+    def write_channel(self, data):
+        for cmd in data.splitlines():
+            self.buffer += f"{cmd}\n{self.responses[cmd]}\n{self.base_prompt}#"
+
+    def read_until_pattern(self, pattern, read_timeout=10.0, re_flags=0):
+        match = re.search(pattern, self.buffer, flags=re_flags)
+        assert match, f"wzorzec {pattern!r} nie znaleziony"
+        chunk, self.buffer = self.buffer[:match.end()], self.buffer[match.end():]
+        return chunk
+
+
+class FakeAutodetectConnection:
+    """Sesja jak z ConnectHandler(device_type="autodetect"): device_type zostaje 'autodetect'."""
+
+    device_type = "autodetect"
+    base_prompt = "sw1"
+
+    def __init__(self, responses, errors=None):
+        self.responses = responses
+        self.errors = errors or {}
+        self.sent = []
+
+    def send_command(self, cmd, **kwargs):
+        self.sent.append(cmd)
+        if cmd in self.errors:
+            raise self.errors[cmd]
+        return self.responses.get(cmd, "")
+
+    def send_command_timing(self, cmd, **kwargs):
+        self.sent.append(cmd)
+        return ""
+
+    def disconnect(self):
+        pass
+
+
+class FakePool:
+    """Pula bez przechowywania sesji - zapisuje tylko, które sesje zwrócono, a które odrzucono."""
+
+    def __init__(self):
+        self.released = []
+        self.discarded = []
+
+    def acquire(self, key, device_params):
+        return cli_utils.ConnectHandler(**device_params)
+
+    def release(self, key, net_connect):
+        self.released.append(net_connect)
+
+    def discard(self, net_connect):
+        self.discarded.append(net_connect)
+
+
+def _discover_with(monkeypatch, host, responses, errors=None, **overrides):
+    config = {**config_loader.load_config("config.ini"), "cli_netmiko_session_log_enabled": False, **overrides}
+    conn = FakeAutodetectConnection(responses, errors)
+    monkeypatch.setattr(cli_utils, "ConnectHandler", lambda **params: conn)
+    # Każdy test używa innej nazwy hosta - cache możliwości w pamięci jest współdzielony w procesie
+    connections = cli_utils.cli_get_neighbors_enhanced(host, "user", "secret", config)
+    return conn, connections
+
+
+def test_autodetect_session_skips_cdp_for_eos_banner(monkeypatch):
+    conn, _ = _discover_with(monkeypatch, "eos1", {"show version": "Arista DCS-7050SX-64\nSoftware image version: 4.28.3M"})
+
+    assert "show lldp neighbors detail" in conn.sent
+    assert "show cdp neighbors detail" not in conn.sent
+
+
+def test_textfsm_parser_chosen_for_ios_show_version_on_autodetect_session(monkeypatch):
+    chosen = []
+    neighbor_parser = cli_utils._neighbor_parser
+
+    def spy(protocol, effective_device_type, config):
+        parser = neighbor_parser(protocol, effective_device_type, config)
+        chosen.append(parser.__name__)
+        return parser
+
+    monkeypatch.setattr(cli_utils, "_neighbor_parser", spy)
+    _discover_with(monkeypatch, "ios1", {"show version": "Cisco IOS Software, C2960X Software",
+                                         "show lldp neighbors detail": "Chassis id: 0011.2233.4455"},
+                   cli_parser_engine="textfsm")
+
+    assert chosen[0] == "_parse_lldp_textfsm_cisco_ios"
+
+
+def test_pooled_session_discarded_after_command_error(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(cli_utils, "_POOL", pool)
+    conn, _ = _discover_with(monkeypatch, "ios2", {"show version": "Cisco IOS Software"},
+                             errors={"show lldp neighbors detail": TimeoutError("ReadTimeout")},
+                             cli_pool_enabled=True)
+
+    assert pool.discarded == [conn]
+    assert pool.released == []
+
+
+def test_send_commands_batched_ignores_prompt_chars_in_output():
+    lldp_out = ("Chassis id: 0011.2233.4455\n"
+                "Port Description: uplink to core# rack 4 > row B\n"
+                "System Name: core1")
+    cdp_out = "Device ID: core1\nInterface: Gi1/0/1,  Port ID (outgoing port): Gi0/1"
+    conn = FakeBatchConnection("sw1", {"show lldp neighbors detail": lldp_out,
+                                       "show cdp neighbors detail": cdp_out})
+
+    outputs = cli_utils._send_commands_batched(
+        conn, ["show lldp neighbors detail", "show cdp neighbors detail"], r"[#>]", 10.0)
+
+    assert outputs == [lldp_out, cdp_out]
+
+
+def test_disk_parse_cache_evicts_lru_and_drops_corrupt_entries(tmp_path):
+    shelf = shelve.open(str(tmp_path / "cli_parse_cache"))
+    disk_cache = cli_utils._DiskParseCache(shelf, ttl=3600, max_entries=2)
+    disk_cache.put("a", ({"local_if": "Gi0/1"},))
+    disk_cache.put("b", ({"local_if": "Gi0/2"},))
+    assert disk_cache.get("a") == ({"local_if": "Gi0/1"},)  # 'a' staje się najświeższy
+    disk_cache.put("c", ({"local_if": "Gi0/3"},))
+
+    assert disk_cache.get("b") is None
+    shelf.dict[b"c"] = b"uszkodzony"
+    assert disk_cache.get("c") is None
+    assert len(disk_cache) == 1
+    disk_cache.close()
+
+    reopened = cli_utils._DiskParseCache(shelve.open(str(tmp_path / "cli_parse_cache")), ttl=3600, max_entries=2)
+    assert reopened.get("a") == ({"local_if": "Gi0/1"},)
+    reopened.close()
+
+
+def test_disk_parse_cache_drops_entries_orphaned_by_a_crash(tmp_path):
+    shelf = shelve.open(str(tmp_path / "cli_parse_cache"))
+    disk_cache = cli_utils._DiskParseCache(shelf, ttl=3600, max_entries=10)
+    disk_cache.put("a", ({"local_if": "Gi0/1"},))
+    shelf.close()  # Bez disk_cache.close() - indeks nie został zapisany, jak po SIGKILL
+
+    shelf = shelve.open(str(tmp_path / "cli_parse_cache"))
+    reopened = cli_utils._DiskParseCache(shelf, ttl=3600, max_entries=10)
+    assert len(reopened) == 0
+    assert "a" not in shelf
+    reopened.close()
+
+
+def test_add_connections_merges_same_link_from_lldp_and_cdp():
+    lldp_conn = {"local_host": "sw1", "local_if": "Gi1/0/1", "neighbor_host": "core1.example.com",
+                 "neighbor_if": "Gi0/1", "vlan": None, "via": "CLI-LLDP"}
+    cdp_conn = {"local_host": "sw1", "local_if": "Gi1/0/1", "neighbor_host": "core1",
+                "neighbor_if": "Gi0/1", "vlan": None, "via": "CLI-CDP"}
+    merged = {}
+
+    cli_utils._add_connections(merged, [lldp_conn])
+    cli_utils._add_connections(merged, [cdp_conn])
+
+    assert list(merged.values()) == [lldp_conn]